@@ -2,9 +2,13 @@
 A module for looking up blitz stats of players on chess.com.
 """
 
-from aiohttp import ClientResponseError, ClientConnectionError
+from aiohttp import ClientResponseError, ClientConnectionError, ClientTimeout
 from datetime import date
 import asyncio
+import logging
+
+
+log = logging.getLogger(__name__)
 
 
 class APIError(Exception):
@@ -17,19 +21,18 @@ class UserNotFound(Exception):
 
 class API:
     site = None
+    base_url = None
+    # per request, so one slow response can't hold the lock forever
+    timeout = ClientTimeout(total=10)
 
     def __init__(self, session):
         self._session = session
         self.lock = asyncio.Lock()
 
-    def log(*args):
-        """Save info of unexpected errors"""
-        # TODO
-        print(args)
-
 
 class ChessComAPI(API):
     site = 'chess.com'
+    base_url = 'https://api.chess.com'
     fields = {
         'blitz': 'chess_blitz',
         'bullet': 'chess_bullet',
@@ -37,7 +40,7 @@ class ChessComAPI(API):
     }
     async def lookup(self, name, game_type='blitz'):
         """Return the current and best ever chess.com rating for the given player name"""
-        url = f"https://api.chess.com/pub/player/{name}/stats"
+        url = f"{self.base_url}/pub/player/{name}/stats"
         stats = await self._call(url)
         field = ChessComAPI.fields[game_type]
         try:
@@ -62,7 +65,7 @@ class ChessComAPI(API):
     async def _call(self, url):
         try:
             async with self.lock:
-                async with self._session.get(url) as resp:
+                async with self._session.get(url, timeout=self.timeout) as resp:
                     resp.raise_for_status()
                     return await resp.json()
         except ClientResponseError as e:
@@ -73,10 +76,10 @@ class ChessComAPI(API):
                 raise APIError("That request confused even chess.com.")
             elif resp.status == 429:
                 # hopefully this doesnt happen due to locks
-                self.log(f"Hit rate limit from chess.com!")
+                log.warning("Hit rate limit from chess.com!")
                 raise APIError("Too many requests; try again.")
             else:
-                self.log(f"Status code {resp.status} on requesting {url}:\n{e}")
+                log.error("Status code %s on requesting %s: %s", resp.status, url, e)
                 raise
         except ClientConnectionError:
             raise APIError(f"Couldn't connect to {self.site}")
@@ -84,6 +87,7 @@ class ChessComAPI(API):
 
 class LichessAPI(API):
     site = 'lichess'
+    base_url = 'https://lichess.org'
     fields = {
         'blitz': 'blitz',
         'bullet': 'bullet',
@@ -91,7 +95,7 @@ class LichessAPI(API):
     }
     async def lookup(self, name, game_type='blitz'):
         """Return the current lichess rating for the given player name"""
-        url = f"https://lichess.org/api/user/{name}"
+        url = f"{self.base_url}/api/user/{name}"
         profile = await self._call(url)
         rating = profile['perfs'][game_type]['rating']
         cased_name = profile['username']
@@ -100,13 +104,13 @@ class LichessAPI(API):
     async def _call(self, url):
         try:
             async with self.lock:
-                async with self._session.get(url) as resp:
+                async with self._session.get(url, timeout=self.timeout) as resp:
                     resp.raise_for_status()
                     return await resp.json()
         except ClientResponseError as e:
             if e.status == 404:
                 raise UserNotFound
-            print(f'lichess {url}', e)
+            log.error("Status code %s on requesting %s: %s", e.status, url, e)
             raise
         except ClientConnectionError:
             raise APIError(f"Couldn't connect to {self.site}")
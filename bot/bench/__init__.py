@@ -0,0 +1,5 @@
+"""
+Benchmarks for the bot, run against local stand-ins for chess.com, lichess, Google and Twitch.
+
+Run from the bot directory, for example `python -m bench.load --help`.
+"""
@@ -0,0 +1,64 @@
+"""
+Microbenchmark of chat message dispatch.
+
+Times `SubBatBot.event_message` on messages that don't end up running a command, which is nearly all chat,
+next to twitchio's `handle_commands` on the same messages, which is what every message used to go through.
+Uses a capture file (see capture.py) when given, otherwise synthetic chat.
+
+    python -m bench.dispatch signup.jsonl.gz
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import time
+import os
+
+from bench.harness import make_bot, make_message, quiet_logging
+from capture import read_capture
+
+
+def synthetic_chat(n, channels=10):
+    lines = ["PogChamp let's go!!", "gg", "what's the time control?", "!discord", "?lurk", "?Apply me", "@streamer hi"]
+    return [(f"streamer{i % channels:03}", f"viewer{i:05}", lines[i % len(lines)]) for i in range(n)]
+
+
+async def time_per_message(handler, messages, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for msg in messages:
+            await handler(msg)
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages)
+
+
+async def main(args):
+    quiet_logging('ERROR')
+    if args.capture:
+        header, entries = read_capture(args.capture)
+        os.environ['BOT_PREFIX'] = header['prefix']
+        chat = [(entry['c'], entry['u'], entry['m']) for entry in entries]
+    else:
+        chat = synthetic_chat(args.messages)
+
+    bot = await make_bot()
+    # commands would do network calls, so only time the messages no command runs for
+    messages = [make_message(bot, *line) for line in chat]
+    messages = [msg for msg in messages if not bot._may_be_command(msg.content)]
+    bot.message_counts.clear()
+    print(f"{len(messages)} of {len(chat)} messages don't run a command")
+
+    filtered = await time_per_message(bot.event_message, messages, args.rounds)
+    unfiltered = await time_per_message(bot.handle_commands, messages, args.rounds)
+    print(f"event_message:   {filtered * 1e6:8.2f} µs/message")
+    print(f"handle_commands: {unfiltered * 1e6:8.2f} µs/message")
+    print(f"counts: {dict(bot.message_counts)}")
+    await bot.http._session.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('capture', nargs='?', help="capture file written by the bot")
+    parser.add_argument('--messages', type=int, default=50000, help="number of synthetic messages")
+    parser.add_argument('--rounds', type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
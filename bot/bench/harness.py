@@ -0,0 +1,239 @@
+"""
+Builds a SubBatBot wired to the stub servers instead of Twitch IRC, Postgres and the real APIs.
+
+Messages are fed straight into `SubBatBot.event_message`, and everything the bot sends back over IRC
+(chat messages and whispers) is recorded with a timestamp, so end-to-end latency can be measured
+from "message arrived" to "user got an answer".
+"""
+
+from collections import defaultdict
+from zlib import crc32
+import logging
+import asyncio
+import os
+import time
+
+# the bot modules read these at import time
+os.environ.setdefault('BOT_NICK', 'subbatbot')
+os.environ.setdefault('BOT_PREFIX', '?')
+os.environ.setdefault('CLIENT_ID', 'bench')
+os.environ.setdefault('CLIENT_SECRET', 'bench')
+
+import aiohttp
+import gspread
+import gspread.client
+import gspread.models
+import gspread.urls
+import requests
+from twitchio.dataclasses import Channel, Message, User
+
+from aio_lookup import ChessComAPI, LichessAPI
+from bot import SubBatBot
+from db import SettingsDatabase
+from sheet import BattleSheet
+import twitch_api
+import sheet
+
+
+class MemorySettings:
+    """In-memory stand-in for SettingsDatabase"""
+
+    def __init__(self):
+        self.settings = {}
+        self.battles = []  # (channel, site, game, players, archived)
+        self.ratings = []  # (site, player, game, timestamp, rating)
+        self.token = {
+            'access_token': 'stubaccess', 'refresh_token': 'stubrefresh',
+            'expires_in': 14400, 'scope': ['user:edit:follows'], 'token_type': 'bearer',
+        }
+
+    def add_channel(self, channel):
+        self.settings[channel] = {**SettingsDatabase.defaults, 'sheet_key': None}
+
+    def delete_channel(self, channel):
+        self.settings.pop(channel, None)
+
+    def update_setting(self, channel, setting, value):
+        self.settings[channel][setting] = value
+
+    def store_key(self, channel, key):
+        self.update_setting(channel, 'sheet_key', key)
+
+    def get_settings(self, channel):
+        if channel not in self.settings:
+            self.add_channel(channel)
+        return dict(self.settings[channel])
+
+    def get_all_settings(self):
+        return {channel: dict(settings) for channel, settings in self.settings.items()}
+
+    def get_all_channels(self):
+        return list(self.settings)
+
+    def archive_battle(self, channel, site, game, players):
+        self.battles.append((channel, site, game, list(players), time.time()))
+        return len(self.battles)
+
+    def get_archived_results(self):
+        return [(player_site, player_chess, player_twitch, result) for _, _, _, players, _ in self.battles
+                for player_twitch, player_chess, _, _, player_site, result in players]
+
+    def get_ratings(self):
+        return list(self.ratings)
+
+    def add_ratings(self, points):
+        self.ratings.extend(points)
+
+    def update_token(self, token, name='twitch_api_token'):
+        self.token = dict(token)
+
+    def get_token(self, name='twitch_api_token'):
+        return dict(self.token)
+
+
+class RecordingSocket:
+    """Takes the place of the IRC websocket, and keeps what the bot sends"""
+
+    def __init__(self):
+        self.sent = []
+        self.whispers = defaultdict(list)
+
+    async def send(self, data):
+        now = time.perf_counter()
+        self.sent.append((now, data))
+        if data.startswith('PRIVMSG #jtv :/w '):
+            user = data.split(' ', 4)[3]
+            self.whispers[user.lower()].append((now, data))
+
+
+class StubClient(gspread.Client):
+    """gspread client without Google credentials, for talking to the stub server"""
+
+    def __init__(self, auth=None, session=None):
+        self.auth = auth
+        self.session = session or requests.Session()
+
+    def login(self):
+        pass
+
+
+def point_at_stubs(base_url):
+    """Redirect every external API the bot knows of to the stub server at base_url"""
+    ChessComAPI.base_url = f"{base_url}/chess.com"
+    LichessAPI.base_url = f"{base_url}/lichess"
+
+    twitch_api.TWITCH_HELIX_URL = f"{base_url}/twitch/helix"
+    twitch_api.TWITCH_TOKEN_URL = f"{base_url}/twitch/oauth2/token"
+    twitch_api.TWITCH_REFRESH_URL = f"{base_url}/twitch/oauth2/token"
+    twitch_api.TWITCH_VALIDATE_URL = f"{base_url}/twitch/oauth2/validate"
+
+    # gspread copies its urls into each module on import, so rewrite all the copies
+    google = {
+        'https://sheets.googleapis.com': f"{base_url}/sheets",
+        'https://www.googleapis.com': f"{base_url}/drive",
+    }
+    for module in (gspread.urls, gspread.client, gspread.models):
+        for attr, value in vars(module).items():
+            if isinstance(value, str):
+                for real, stub in google.items():
+                    if value.startswith(real):
+                        setattr(module, attr, stub + value[len(real):])
+
+    gspread.authorize = lambda credentials, client_class=StubClient: client_class(credentials)
+    sheet.agcm = sheet.CustomAGCM(lambda: None)
+
+
+def quiet_logging(level='WARNING'):
+    """The bot logs at debug level to stdout, which would drown out the results"""
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(level)
+
+
+def make_message(bot, channel_name, user_name, content, sub=False, mod=False, founder=False):
+    """A twitchio Message like the ones parsed from IRC, with the tags the bot cares about"""
+    badges = []
+    if mod:
+        badges.append('moderator/1')
+    if founder:
+        badges.append('founder/0')
+    elif sub:
+        badges.append('subscriber/12')
+    tags = {
+        'display-name': user_name,
+        'user-id': crc32(user_name.lower().encode()),
+        'subscriber': int(sub),
+        'mod': int(mod),
+        'badges': ','.join(badges),
+        'tmi-sent-ts': int(time.time() * 1000),
+    }
+    channel = Channel(name=channel_name, ws=bot._ws, http=bot.http)
+    author = User(bot._ws, author=user_name.lower(), channel=channel, tags=tags)
+    return Message(author=author, channel=channel, content=content, tags=tags, raw_data='')
+
+
+async def make_bot(db=None, socket=None):
+    """A SubBatBot that isn't connected to anything, sending over the given (or a new) RecordingSocket"""
+    bot = SubBatBot(
+        irc_token='oauth:bench',
+        client_id='bench',
+        nick=os.environ['BOT_NICK'],
+        prefix=os.environ['BOT_PREFIX'],
+        initial_channels=[],
+        loop=asyncio.get_event_loop(),
+        db=db or MemorySettings(),
+    )
+    bot._ws._websocket = socket or RecordingSocket()
+    # let the prefix setter task scheduled by twitchio run
+    await asyncio.sleep(0)
+    return bot
+
+
+class BenchBot:
+    """A SubBatBot with stub connections, ready to receive messages in the given channels"""
+
+    def __init__(self, stubs, channels, site='chess.com', game='blitz', sheets_delay=0.0):
+        self.stubs = stubs
+        self.channel_names = list(channels)
+        self.site = site
+        self.game = game
+        self.sheets_delay = sheets_delay
+        self.bot = None
+        self.socket = RecordingSocket()
+        self._session = None
+
+    async def start(self):
+        point_at_stubs(self.stubs.base_url)
+        sheet.agcm.gspread_delay = self.sheets_delay
+
+        db = MemorySettings()
+        for channel_name in self.channel_names:
+            db.add_channel(channel_name)
+            db.update_setting(channel_name, 'site', self.site)
+            db.update_setting(channel_name, 'game', self.game)
+            db.store_key(channel_name, self.stubs.add_spreadsheet(channel_name))
+
+        self.bot = await make_bot(db, self.socket)
+
+        self._session = aiohttp.ClientSession()
+        self.bot.apis = {
+            'lichess': LichessAPI(self._session),
+            'chess.com': ChessComAPI(self._session),
+        }
+        for channel_name, settings in db.get_all_settings().items():
+            battle_sheet = await BattleSheet.open(channel_name, settings)
+            await battle_sheet.refresh_headers()
+            self.bot.sheets[channel_name] = battle_sheet
+        return self
+
+    async def stop(self):
+        await self._session.close()
+        await self.bot.http._session.close()
+
+    async def settle(self):
+        """Wait for the applies the bot has queued up to be handled"""
+        await self.bot.cogs['Commands'].applies.join()
+
+    async def send(self, channel_name, user_name, content, **badges):
+        """Deliver a chat message to the bot, as if it came in over IRC"""
+        msg = make_message(self.bot, channel_name, user_name, content, **badges)
+        await self.bot.event_message(msg)
@@ -0,0 +1,176 @@
+"""
+Synthetic sub battle signup rush.
+
+Floods a stubbed bot with ?apply messages (and optionally ordinary chatter) across many channels,
+then reports applies/sec, end-to-end latency percentiles, API calls per apply and peak memory.
+
+    python -m bench.load --channels 20 --applicants 2000 --rate 200 --latency 80 --sheets-latency 250
+"""
+
+from argparse import ArgumentParser
+from random import Random
+import tracemalloc
+import resource
+import asyncio
+import json
+import time
+
+from bench.stubs import StubServers
+from bench.harness import BenchBot, quiet_logging
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def make_events(channels, applicants, rate, chatter, sub_share, reapply_share, skew, seed):
+    """Return (seconds from start, channel, user, content, badges) for every message in the rush.
+
+    skew > 0 makes channel popularity fall off like a zipf distribution, so the first channel is the big one.
+    """
+    random = Random(seed)
+    channel_weights = [1 / (rank ** skew) for rank in range(1, len(channels) + 1)]
+    events = []
+    for i in range(applicants):
+        channel = random.choices(channels, channel_weights)[0]
+        user = f"viewer{i:05}"
+        sub = random.random() < sub_share
+        events.append([channel, user, f"?apply chess{i:05}", {'sub': sub}])
+        if random.random() < reapply_share:
+            events.append([channel, user, f"?apply chess{i:05}", {'sub': not sub}])
+        for j in range(chatter):
+            events.append([channel, f"lurker{i:05}_{j}", "PogChamp let's go!!", {}])
+    random.shuffle(events)
+    interval = 1 / rate if rate else 0
+    return [(n * interval, *event) for n, event in enumerate(events)]
+
+
+async def run(events, bench, prefix='?'):
+    """Feed the events to the bot on schedule, and measure how long every apply took to get its whisper"""
+    start = time.perf_counter()
+    sent_at = []
+    tasks = []
+    for at, channel, user, content, badges in events:
+        delay = start + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if content.startswith(f"{prefix}apply"):
+            sent_at.append((user, time.perf_counter()))
+        tasks.append(asyncio.ensure_future(bench.send(channel, user, content, **badges)))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    await bench.settle()
+    elapsed = time.perf_counter() - start
+    errors = [r for r in results if isinstance(r, Exception)]
+
+    # pair each apply with the first whisper to that user which came after it
+    whispers = {user: iter(sorted(t for t, data in w))
+                for user, w in bench.socket.whispers.items()}
+    latencies = []
+    for user, t in sorted(sent_at, key=lambda pair: pair[1]):
+        for answered in whispers.get(user, ()):
+            if answered >= t:
+                latencies.append(answered - t)
+                break
+    applies = len(sent_at)
+    return elapsed, sorted(latencies), applies, errors
+
+
+def summarize(elapsed, latencies, applies, stubs, errors=()):
+    calls = {f"{service} {endpoint}": n for (service, endpoint), n in sorted(stubs.calls.items())}
+    return {
+        'applies': applies,
+        'answered': len(latencies),
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'applies_per_sec': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            f'p{p}': round(percentile(latencies, p) * 1000, 1) for p in (50, 95, 99)
+        },
+        'api_calls_per_apply': round(stubs.api_calls() / applies, 2) if applies else None,
+        'api_calls': calls,
+        'rate_limited': dict(stubs.rate_limited),
+    }
+
+
+def print_summary(summary):
+    print(f"{summary['answered']}/{summary['applies']} applies answered in {summary['seconds']}s "
+          f"({summary['applies_per_sec']}/s), {summary['errors']} errors")
+    latency = summary['latency_ms']
+    print(f"latency: p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms")
+    print(f"api calls per apply: {summary['api_calls_per_apply']}")
+    for endpoint, n in summary['api_calls'].items():
+        print(f"  {n:7} {endpoint}")
+    if summary['rate_limited']:
+        print(f"429s served: {summary['rate_limited']}")
+    print(f"peak memory: {summary['peak_rss_mb']} MB rss"
+          + (f", {summary['peak_traced_mb']} MB traced" if 'peak_traced_mb' in summary else ''))
+
+
+def add_stub_arguments(parser):
+    """Options for the stub servers and bot setup, shared with the other benchmarks"""
+    parser.add_argument('--site', default='chess.com', choices=('chess.com', 'lichess', 'both'))
+    parser.add_argument('--latency', type=float, default=50, help="ms added to every stub response")
+    parser.add_argument('--sheets-latency', type=float, help="ms added to Google responses, defaults to --latency")
+    parser.add_argument('--jitter', type=float, default=0, help="up to this many extra ms per response")
+    parser.add_argument('--rate-limit', type=float, default=0, help="share of stub responses that are 429s")
+    parser.add_argument('--sheets-delay', type=float, default=0,
+                        help="seconds between Sheets calls enforced by the client manager (1.1 in production)")
+    parser.add_argument('--tracemalloc', action='store_true', help="also trace python allocations (slower)")
+    parser.add_argument('--json', help="write the summary to this file")
+    parser.add_argument('--log-level', default='WARNING', help="level for the bot's log output during the run")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def make_stubs(args):
+    latency = args.latency / 1000
+    sheets_latency = latency if args.sheets_latency is None else args.sheets_latency / 1000
+    latencies = {
+        'chess.com': latency, 'lichess': latency, 'twitch': latency,
+        'sheets': sheets_latency, 'drive': sheets_latency,
+    }
+    return StubServers(latency=latencies, jitter=args.jitter / 1000, rate_limit=args.rate_limit, seed=args.seed)
+
+
+def finish(summary, args):
+    summary['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    if args.tracemalloc:
+        summary['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+async def main(args):
+    if args.tracemalloc:
+        tracemalloc.start()
+    channels = [f"streamer{i:03}" for i in range(args.channels)]
+    events = make_events(channels, args.applicants, args.rate, args.chatter,
+                         args.sub_share, args.reapply_share, args.skew, args.seed)
+    stubs = make_stubs(args)
+    stubs.start()
+    quiet_logging(args.log_level)
+    bench = await BenchBot(stubs, channels, site=args.site, sheets_delay=args.sheets_delay).start()
+    stubs.reset_counts()
+    try:
+        elapsed, latencies, applies, errors = await run(events, bench)
+    finally:
+        await bench.stop()
+        stubs.stop()
+    finish(summarize(elapsed, latencies, applies, stubs, errors), args)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--applicants', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200, help="messages per second, 0 sends all at once")
+    parser.add_argument('--chatter', type=int, default=0, help="non-command messages per applicant")
+    parser.add_argument('--sub-share', type=float, default=0.5)
+    parser.add_argument('--reapply-share', type=float, default=0.05, help="share of users applying twice")
+    parser.add_argument('--skew', type=float, default=1.0, help="zipf exponent for channel popularity")
+    add_stub_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,319 @@
+"""
+Microbenchmarks of the bot's core data paths.
+
+Each one times a single piece of the bot on made up inputs, at a realistic size and an extreme one:
+
+    refresh_users    parsing a batchGet of the signup tabs into users_on_sheet and signup_rows
+    add_data         add_data on re-applies, first applies and sub status changes, with worksheets that answer at once
+    append_range     _append, which reads the new row number out of updatedRange with a regex
+    row_values       _create_header_data and the row formatting of add_data
+    chesscom_lookup  ChessComAPI.lookup picking the ratings out of a stats response, JSON decoding included
+    dispatch         event_message on chat that doesn't run a command
+
+Every run is appended to a results file as one JSON line and compared with the run before it, so
+regressions in any one piece show up.
+
+    python -m bench.micro
+    python -m bench.micro refresh_users add_data --size extreme --results micro.ndjson
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime
+from types import SimpleNamespace
+import subprocess
+import platform
+import asyncio
+import logging
+import random
+import json
+import time
+import os
+
+from bench.harness import MemorySettings, make_bot, make_message, quiet_logging
+from bench.dispatch import synthetic_chat
+from aio_lookup import ChessComAPI
+from db import SettingsDatabase
+from sheet import BattleSheet
+import sheet as sheet_module
+
+
+BENCHMARKS = {}  # name -> (setup, {size label: size})
+
+
+def benchmark(name, realistic, extreme):
+    """Register setup(loop, size) as a benchmark. It returns (fn, ops) or (fn, ops, close): fn does ops
+    operations per call, and can be a coroutine function. close is a coroutine function run afterwards."""
+    def register(setup):
+        BENCHMARKS[name] = setup, {'realistic': realistic, 'extreme': extreme}
+        return setup
+    return register
+
+
+def fake_sheet(site='chess.com', delta='off', format='none'):
+    settings = {**SettingsDatabase.defaults, 'site': site, 'delta': delta, 'format': format, 'sheet_key': 'micro'}
+    logging.disable(logging.INFO)  # BattleSheet says hi on init
+    sheet = BattleSheet('micro', settings)
+    logging.disable(logging.NOTSET)
+    sheet._create_header_data()
+    return sheet
+
+
+def sheet_rows(n, start=0):
+    """Rows as batchGet returns them, all strings"""
+    rng = random.Random(n)
+    return [[f"viewer{i:07}", f"chess{i:07}", str(rng.randint(400, 2800)), '-', str(rng.randint(400, 2900)),
+             '2020-05-20', ''] for i in range(start, start + n)]
+
+
+def signed_up_sheet(n):
+    """A sheet whose batch_get answers with n signups, half of them subs"""
+    sheet = fake_sheet()
+    response = {'spreadsheetId': 'micro', 'valueRanges': [
+        {'range': f"Subs!A2:Z{n // 2 + 1}", 'majorDimension': 'ROWS', 'values': sheet_rows(n // 2)},
+        {'range': f"'Not subs'!A2:Z{n - n // 2 + 1}", 'majorDimension': 'ROWS', 'values': sheet_rows(n - n // 2, n // 2)},
+    ]}
+
+    async def batch_get(ranges, **params):
+        return response
+    sheet.batch_get = batch_get
+    return sheet
+
+
+@benchmark('refresh_users', realistic=300, extreme=50000)
+def refresh_users(loop, n):
+    return signed_up_sheet(n).refresh_users, 1
+
+
+class FakeWorksheet:
+    """Stands in for a gspread_asyncio worksheet, answering at once"""
+
+    def __init__(self, title, row_nr):
+        self.title = title
+        self.row_nr = row_nr
+        self.cells = [SimpleNamespace(value='') for _ in range(26)]
+
+    async def append_row(self, values):
+        self.row_nr += 1
+        return {'updates': {'updatedRange': f"'{self.title}'!A{self.row_nr}:I{self.row_nr}"}}
+
+    async def range(self, name):
+        return self.cells
+
+    async def update_cells(self, cells):
+        pass
+
+    async def delete_row(self, row_nr):
+        pass
+
+
+class FakeClient:
+    """Stands in for the authorized client and spreadsheet add_data gets from agcm"""
+
+    def __init__(self, worksheets):
+        self.worksheets = worksheets
+
+    async def authorize(self):
+        return self
+
+    async def open(self, title):
+        return self
+
+    async def get_worksheet(self, index):
+        return self.worksheets[index]
+
+    async def worksheet(self, title):
+        return next(ws for ws in self.worksheets if ws.title == title)
+
+
+@benchmark('add_data', realistic=300, extreme=200000)
+def add_data(loop, n):
+    sheet = signed_up_sheet(n)
+    loop.run_until_complete(sheet.refresh_users())
+    # add_data only reaches Google through the module's agcm, which no other benchmark uses
+    sheet_module.agcm = FakeClient([FakeWorksheet('Subs', n // 2 + 1), FakeWorksheet('Not subs', n - n // 2 + 1)])
+    rng = random.Random(n)
+    ops = []
+    for _ in range(1000):
+        kind = rng.random()
+        i = rng.randrange(n)
+        if kind < 0.7:
+            ops.append((f"viewer{i:07}", i < n // 2))  # re-apply, same tab
+        elif kind < 0.9:
+            ops.append((f"newcomer{i:07}", True))  # first apply, the first time round
+        else:
+            ops.append((f"viewer{i:07}", i >= n // 2))  # sub status changed, and back on the next round
+    row = 'chess0000001', 1500, 1550, '2020-05-20'
+
+    async def run():
+        for name, sub in ops:
+            await sheet.add_data(name, *row, sub=sub)
+    return run, len(ops)
+
+
+@benchmark('append_range', realistic=300, extreme=1000000)
+def append_range(loop, row_nr):
+    sheet = fake_sheet()
+    ws = FakeWorksheet('Not subs', row_nr)
+    values = sheet_rows(1)[0]
+
+    async def run():
+        await sheet._append(ws, 'viewer0000001', values)
+    return run, 1
+
+
+@benchmark('row_values', realistic='chess.com', extreme='both')
+def row_values(loop, site):
+    if site == 'both':
+        # widest header, longest names twitch and chess.com allow
+        sheet = fake_sheet('both', delta='on', format='bracket')
+        args = 'v' * 25, 'c' * 25, 2800, 2850, '2020-05-20', 'l' * 20, 2900
+    else:
+        sheet = fake_sheet('chess.com', format='bracket')
+        args = 'viewer0000001', 'chess0000001', 1500, 1550, '2020-05-20'
+    extras = {'Battles': '3 battles, 2W 1L 0D', 'Rating change': '+25'}
+
+    def run():
+        sheet._create_header_data()
+        sheet.row_values(*args, extras=extras)
+    return run, 1
+
+
+def chesscom_stats(extra_fields):
+    game = {
+        'last': {'rating': 1500, 'date': 1600000000, 'rd': 50},
+        'best': {'rating': 1650, 'date': 1590000000, 'game': 'https://www.chess.com/live/game/1'},
+        'record': {'win': 500, 'loss': 450, 'draw': 50},
+    }
+    stats = {f"chess_{kind}": game for kind in ('daily', 'rapid', 'bullet', 'blitz')}
+    stats.update({
+        'fide': 0,
+        'tactics': {'highest': {'rating': 2000, 'date': 1500000000}, 'lowest': {'rating': 400, 'date': 1400000000}},
+        'lessons': {},
+        'puzzle_rush': {'best': {'total_attempts': 40, 'score': 35}},
+    })
+    # other variants and whatever chess.com adds over the years
+    stats.update({f"chess960_variant_{i}": game for i in range(extra_fields)})
+    return json.dumps(stats)
+
+
+@benchmark('chesscom_lookup', realistic=0, extreme=2000)
+def chesscom_lookup(loop, extra_fields):
+    api = ChessComAPI(session=None)
+    raw = chesscom_stats(extra_fields)
+
+    async def call(url):
+        return json.loads(raw)
+    api._call = call
+
+    async def run():
+        await api.lookup('chess0000001', 'blitz')
+    return run, 1
+
+
+@benchmark('dispatch', realistic=80, extreme=500)
+def dispatch(loop, length):
+    bot = loop.run_until_complete(make_bot(MemorySettings()))
+    lines = synthetic_chat(1000)
+    messages = [make_message(bot, channel, user, (content * (length // len(content) + 1))[:length])
+                for channel, user, content in lines]
+    # only what doesn't run a command, which is nearly all chat and needs no network
+    messages = [msg for msg in messages if not bot._may_be_command(msg.content)]
+    bot.message_counts.clear()  # the filtering above counted them once already
+
+    async def run():
+        for msg in messages:
+            await bot.event_message(msg)
+    return run, len(messages), bot.http._session.close
+
+
+def best_time(loop, fn, min_time, repeat):
+    """Best seconds per call over repeat rounds, each long enough to take at least min_time"""
+    if asyncio.iscoroutinefunction(fn):
+        async def calls(n):
+            start = time.perf_counter()
+            for _ in range(n):
+                await fn()
+            return time.perf_counter() - start
+
+        def timed(n):
+            return loop.run_until_complete(calls(n))
+    else:
+        def timed(n):
+            start = time.perf_counter()
+            for _ in range(n):
+                fn()
+            return time.perf_counter() - start
+
+    n = 1
+    while timed(n) < min_time:
+        n *= 2
+    return min(timed(n) for _ in range(repeat)) / n
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_run(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def main(args):
+    quiet_logging('WARNING')
+    logging.getLogger().setLevel(logging.WARNING)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    previous = last_run(args.results)
+    sizes = ('realistic', 'extreme') if args.size == 'all' else (args.size,)
+
+    results = {}
+    print(f"{'benchmark':34} {'µs/op':>12} {'change':>8}")
+    for name in args.benchmarks or BENCHMARKS:
+        setup, size_values = BENCHMARKS[name]
+        for size in sizes:
+            fn, ops, *close = setup(loop, size_values[size])
+            per_op = best_time(loop, fn, args.min_time, args.repeat) / ops * 1e6
+            for coro_fn in close:
+                loop.run_until_complete(coro_fn())
+            key = f"{name}/{size}"
+            results[key] = {'size': size_values[size], 'us_per_op': round(per_op, 4)}
+            change = ''
+            before = previous and previous['results'].get(key)
+            if before and before['size'] == size_values[size]:
+                change = f"{(per_op / before['us_per_op'] - 1) * 100:+.1f}%"
+            print(f"{key + f' ({size_values[size]})':34} {per_op:12.3f} {change:>8}")
+
+    run = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(run) + '\n')
+    if previous:
+        print(f"compared with {previous['time']} ({previous.get('commit')})")
+    loop.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"any of {', '.join(BENCHMARKS)}, all by default")
+    parser.add_argument('--size', default='all', choices=('realistic', 'extreme', 'all'))
+    parser.add_argument('--results', default='micro-results.ndjson', help="file the runs are appended to")
+    parser.add_argument('--min-time', type=float, default=0.2, help="seconds each timing round takes at least")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    main(args)
@@ -0,0 +1,67 @@
+"""
+Benchmark of rating-based pairing.
+
+Times `pair_players` on normally distributed ratings, next to a naive pairing that takes each sub in turn
+and scans every remaining non-sub for the closest rating, which is what matching by hand amounts to.
+The naive one is quadratic, so it's only run up to --naive-max players per side.
+
+    python -m bench.pairing --players 100 1000 10000
+"""
+
+from argparse import ArgumentParser
+import random
+import time
+
+from pairing import Pairing, pair_players
+
+
+def make_players(n, prefix, rng, mean=1500, spread=350):
+    return [(max(100, int(rng.gauss(mean, spread))), f"{prefix}{i:05}") for i in range(n)]
+
+
+def pair_naive(subs, non_subs):
+    left = list(non_subs)
+    pairs, unpaired_subs = [], []
+    for sub in sorted(subs):
+        if not left:
+            unpaired_subs.append(sub)
+            continue
+        closest = min(range(len(left)), key=lambda k: abs(left[k][0] - sub[0]))
+        pairs.append((sub, left.pop(closest)))
+    return Pairing(pairs, unpaired_subs, left)
+
+
+def best_time(fn, *args, rounds=3):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(name, seconds, pairing):
+    mean_gap = pairing.total_gap / len(pairing.pairs) if pairing.pairs else 0
+    print(f"  {name:8} {seconds * 1000:10.2f} ms  {len(pairing.pairs):6} pairs  "
+          f"total gap {pairing.total_gap:9}  mean gap {mean_gap:6.1f}")
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    for n in args.players:
+        subs = make_players(n, 'sub', rng)
+        non_subs = make_players(int(n * args.ratio), 'viewer', rng)
+        print(f"{len(subs)} subs, {len(non_subs)} non-subs")
+        report('pairing', *best_time(pair_players, subs, non_subs, args.max_gap))
+        if n <= args.naive_max:
+            report('naive', *best_time(pair_naive, subs, non_subs, rounds=1))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--players', type=int, nargs='+', default=[100, 1000, 10000], help="subs per run")
+    parser.add_argument('--ratio', type=float, default=1.5, help="non-subs per sub")
+    parser.add_argument('--max-gap', type=int, help="leave players unpaired beyond this rating gap")
+    parser.add_argument('--naive-max', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+"""
+Replay of captured chat traffic.
+
+Feeds a capture made with CHAT_CAPTURE set (see capture.py) into a stubbed bot, at the original pace or
+sped up, and reports the same numbers as bench.load, so releases can be compared on real signup rushes.
+
+    python -m bench.replay signup.jsonl.gz --speed 2 --latency 80 --sheets-latency 250
+"""
+
+from argparse import ArgumentParser
+import tracemalloc
+import asyncio
+import os
+
+from bench.load import add_stub_arguments, make_stubs, run, summarize, finish
+from bench.harness import BenchBot, quiet_logging
+from capture import read_capture
+
+
+def make_events(entries, speed=1.0, start=0.0, end=None):
+    """Turn capture entries into bench.load events, with times scaled by speed"""
+    events = []
+    for entry in entries:
+        t = entry['t']
+        if t < start or (end is not None and t > end):
+            continue
+        badges = {'sub': bool(entry.get('s')), 'founder': bool(entry.get('f')), 'mod': bool(entry.get('o'))}
+        events.append(((t - start) / speed, entry['c'], entry['u'], entry['m'], badges))
+    return events
+
+
+async def main(args):
+    if args.tracemalloc:
+        tracemalloc.start()
+    header, entries = read_capture(args.capture)
+    prefix = header['prefix']
+    os.environ['BOT_PREFIX'] = prefix
+    events = make_events(entries, args.speed, args.start, args.end)
+    channels = sorted({event[1] for event in events})
+    print(f"Replaying {len(events)} messages in {len(channels)} channels from a capture started "
+          f"{header['started']}, at {args.speed}x speed")
+
+    stubs = make_stubs(args)
+    stubs.start()
+    quiet_logging(args.log_level)
+    bench = await BenchBot(stubs, channels, site=args.site, sheets_delay=args.sheets_delay).start()
+    stubs.reset_counts()
+    try:
+        elapsed, latencies, applies, errors = await run(events, bench, prefix)
+    finally:
+        await bench.stop()
+        stubs.stop()
+    finish(summarize(elapsed, latencies, applies, stubs, errors), args)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('capture', help="capture file written by the bot")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay this many times faster than real time")
+    parser.add_argument('--start', type=float, default=0.0, help="skip to this many seconds into the capture")
+    parser.add_argument('--end', type=float, help="stop at this many seconds into the capture")
+    add_stub_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,334 @@
+"""
+Local stub servers for the external services the bot talks to.
+
+One aiohttp app serves all of them under separate path prefixes, with configurable latency and injected
+429 responses per service. Every request is counted, so API calls per apply can be reported.
+"""
+
+from collections import Counter
+from itertools import count
+from hashlib import md5
+from random import Random
+from re import match
+import threading
+import asyncio
+import json
+
+from aiohttp import web
+
+
+SERVICES = ('chess.com', 'lichess', 'sheets', 'drive', 'twitch')
+
+
+def fake_rating(name, game_type='blitz'):
+    """Deterministic rating for a made up player, so runs are comparable"""
+    digest = md5(f"{name.lower()}:{game_type}".encode()).digest()
+    return 600 + int.from_bytes(digest[:2], 'big') % 2200
+
+
+def col_to_nr(col):
+    nr = 0
+    for char in col.upper():
+        nr = nr * 26 + ord(char) - 64
+    return nr
+
+
+def nr_to_col(nr):
+    col = ''
+    while nr:
+        nr, rem = divmod(nr - 1, 26)
+        col = chr(65 + rem) + col
+    return col
+
+
+def parse_range(range_name):
+    """Split a range like 'Subs'!A2:F2 into (title, first_row, first_col, last_row, last_col).
+
+    Missing bounds come back as None, so 'Subs'!A2:A has no last row.
+    """
+    title, _, cells = range_name.rpartition('!')
+    if not title:
+        title, cells = cells, ''
+    title = title.strip("'").replace("''", "'")
+    start, _, end = cells.partition(':')
+    bounds = []
+    for cell in (start, end or start):
+        m = match(r'([A-Za-z]*)(\d*)$', cell)
+        col, row = m.groups()
+        bounds.append((int(row) if row else None, col_to_nr(col) if col else None))
+    (first_row, first_col), (last_row, last_col) = bounds
+    return title, first_row or 1, first_col or 1, last_row, last_col
+
+
+class StubSpreadsheet:
+    def __init__(self, key, title, worksheet_titles=('Subs', 'Not subs')):
+        self.key = key
+        self.title = title
+        self.worksheets = {ws_title: [] for ws_title in worksheet_titles}
+        # sheet ids stay put when worksheets are added or deleted, like the real ones
+        self.sheet_ids = {ws_title: i for i, ws_title in enumerate(worksheet_titles)}
+
+    def properties(self, title):
+        index = list(self.worksheets).index(title)
+        return {'title': title, 'sheetId': self.sheet_ids[title], 'index': index,
+                'gridProperties': {'rowCount': 1000}}
+
+    def metadata(self):
+        sheets = [{'properties': self.properties(title)} for title in self.worksheets]
+        return {'spreadsheetId': self.key, 'properties': {'title': self.title}, 'sheets': sheets}
+
+    def get(self, range_name, major_dimension='ROWS'):
+        title, first_row, first_col, last_row, last_col = parse_range(range_name)
+        rows = self.worksheets[title][first_row - 1:last_row]
+        values = [row[first_col - 1:last_col] for row in rows]
+        if major_dimension == 'COLUMNS':
+            width = max((len(row) for row in values), default=0)
+            values = [[row[i] if i < len(row) else '' for row in values] for i in range(width)]
+        value_range = {'range': range_name, 'majorDimension': major_dimension}
+        # like the real thing, empty ranges come back without values
+        if values:
+            value_range['values'] = values
+        return value_range
+
+    def update(self, range_name, values):
+        title, first_row, first_col, _, _ = parse_range(range_name)
+        rows = self.worksheets[title]
+        for row_offset, new_values in enumerate(values):
+            row_nr = first_row + row_offset
+            while len(rows) < row_nr:
+                rows.append([])
+            row = rows[row_nr - 1]
+            end = first_col - 1 + len(new_values)
+            row.extend([''] * (end - len(row)))
+            row[first_col - 1:end] = new_values
+
+    def append(self, range_name, values):
+        title = parse_range(range_name)[0]
+        rows = self.worksheets[title]
+        first_row = len(rows) + 1
+        rows.extend(list(row) for row in values)
+        last_row = len(rows)
+        width = max(len(row) for row in values)
+        return {'updates': {'updatedRange': f"'{title}'!A{first_row}:{nr_to_col(width)}{last_row}"}}
+
+    def clear(self, range_name):
+        title = parse_range(range_name)[0]
+        self.worksheets[title] = []
+
+    def batch_update(self, requests):
+        titles = {sheet_id: title for title, sheet_id in self.sheet_ids.items()}
+        replies = []
+        for request in requests:
+            reply = {}
+            if 'deleteDimension' in request:
+                dim_range = request['deleteDimension']['range']
+                rows = self.worksheets[titles[dim_range['sheetId']]]
+                del rows[dim_range['startIndex']:dim_range['endIndex']]
+            elif 'updateSheetProperties' in request:
+                props = request['updateSheetProperties']['properties']
+                old_title = titles[props['sheetId']]
+                if 'title' in props:
+                    self.worksheets = {props['title'] if t == old_title else t: rows
+                                       for t, rows in self.worksheets.items()}
+                    self.sheet_ids[props['title']] = self.sheet_ids.pop(old_title)
+                    titles[props['sheetId']] = props['title']
+            elif 'addSheet' in request:
+                title = request['addSheet']['properties']['title']
+                self.worksheets[title] = []
+                self.sheet_ids[title] = max(self.sheet_ids.values(), default=-1) + 1
+                titles[self.sheet_ids[title]] = title
+                reply = {'addSheet': {'properties': self.properties(title)}}
+            elif 'deleteSheet' in request:
+                title = titles.pop(request['deleteSheet']['sheetId'])
+                del self.worksheets[title], self.sheet_ids[title]
+            replies.append(reply)
+        return replies
+
+
+class StubServers:
+    """Stand-ins for chess.com, lichess, Google Sheets/Drive and Twitch, in one local aiohttp server.
+
+    latency: seconds added to every response, per service (or one value for all)
+    rate_limit: probability of answering 429 instead, per service (or one value for all)
+    missing_players: names which chess.com and lichess claim not to know
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=0.0, missing_players=(), seed=0):
+        self.latency = latency if isinstance(latency, dict) else dict.fromkeys(SERVICES, latency)
+        self.rate_limit = rate_limit if isinstance(rate_limit, dict) else dict.fromkeys(SERVICES, rate_limit)
+        self.jitter = jitter
+        self.missing_players = {name.lower() for name in missing_players}
+        self.random = Random(seed)
+
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self.spreadsheets = {}
+        self._keys = count(1)
+
+        self.base_url = None
+        self._runner = None
+        self._loop = None
+
+    def add_spreadsheet(self, title):
+        key = f"stubsheet{next(self._keys):06}"
+        self.spreadsheets[key] = StubSpreadsheet(key, title)
+        return key
+
+    def api_calls(self, service=None):
+        if service is None:
+            return sum(self.calls.values())
+        return sum(n for (s, _), n in self.calls.items() if s == service)
+
+    def reset_counts(self):
+        self.calls.clear()
+        self.rate_limited.clear()
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve from a thread with its own event loop, and return the base url.
+
+        A blocking call from the bot to a stub on the bot's own loop would never get its answer,
+        and the stubs shouldn't eat into the bot's loop time anyway.
+        """
+        ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._start(host, port))
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=serve, name='stub-servers', daemon=True).start()
+        ready.wait()
+        return self.base_url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _start(self, host, port):
+        app = web.Application(middlewares=[self._middleware])
+        app.add_routes([
+            web.get('/chess.com/pub/player/{name}/stats', self.chesscom_stats),
+            web.get('/lichess/api/user/{name}', self.lichess_user),
+            web.route('*', '/sheets/v4/spreadsheets/{tail:.*}', self.sheets),
+            web.route('*', '/drive/{tail:.*}', self.drive),
+            web.route('*', '/twitch/{tail:.*}', self.twitch),
+        ])
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        service = request.path.split('/')[1]
+        self.calls[service, self._endpoint(request)] += 1
+        delay = self.latency.get(service, 0)
+        if self.jitter:
+            delay += self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.random.random() < self.rate_limit.get(service, 0):
+            self.rate_limited[service] += 1
+            return web.json_response({'error': {'code': 429, 'message': 'Too many requests'}}, status=429)
+        return await handler(request)
+
+    @staticmethod
+    def _endpoint(request):
+        """Short name for the kind of request, for the call counts"""
+        last = request.path.rsplit('/', 1)[-1]
+        if ':' in last:
+            return f"{request.method} {last.rsplit(':', 1)[-1]}"
+        if '/values/' in request.path:
+            return f"{request.method} values"
+        resource = request.match_info.route.resource
+        return f"{request.method} {resource.canonical if resource else request.path}"
+
+    async def chesscom_stats(self, request):
+        name = request.match_info['name']
+        if name.lower() in self.missing_players:
+            raise web.HTTPNotFound()
+        stats = {}
+        for game_type in ('blitz', 'bullet', 'rapid'):
+            rating = fake_rating(name, game_type)
+            stats[f'chess_{game_type}'] = {
+                'last': {'rating': rating, 'date': 1600000000, 'rd': 50},
+                'best': {'rating': rating + 50, 'date': 1590000000, 'game': ''},
+                'record': {'win': 10, 'loss': 10, 'draw': 2},
+            }
+        return web.json_response(stats)
+
+    async def lichess_user(self, request):
+        name = request.match_info['name']
+        if name.lower() in self.missing_players:
+            raise web.HTTPNotFound()
+        perfs = {game_type: {'games': 100, 'rating': fake_rating(name, game_type), 'rd': 50, 'prog': 0}
+                 for game_type in ('blitz', 'bullet', 'rapid')}
+        return web.json_response({'id': name.lower(), 'username': name, 'perfs': perfs})
+
+    async def sheets(self, request):
+        key, _, rest = request.match_info['tail'].partition('/')
+        key, _, action = key.partition(':')
+        ss = self.spreadsheets.get(key)
+        if ss is None:
+            raise web.HTTPNotFound()
+        body = json.loads(await request.read() or 'null')
+
+        if not rest:
+            if action == 'batchUpdate':
+                replies = ss.batch_update(body['requests'])
+                return web.json_response({'spreadsheetId': key, 'replies': replies})
+            return web.json_response(ss.metadata())
+
+        if rest == 'values:batchGet':
+            dimension = request.query.get('majorDimension', 'ROWS')
+            ranges = request.query.getall('ranges')
+            return web.json_response({'spreadsheetId': key, 'valueRanges': [ss.get(r, dimension) for r in ranges]})
+        if rest == 'values:batchUpdate':
+            for data in body['data']:
+                ss.update(data['range'], data['values'])
+            return web.json_response({'spreadsheetId': key})
+        if rest == 'values:batchClear':
+            for range_name in body['ranges']:
+                ss.clear(range_name)
+            return web.json_response({'spreadsheetId': key})
+
+        range_name = rest[len('values/'):]
+        if range_name.endswith(':append'):
+            return web.json_response(ss.append(range_name[:-len(':append')], body['values']))
+        if request.method == 'PUT':
+            ss.update(range_name, body['values'])
+            return web.json_response({'spreadsheetId': key, 'updatedRange': range_name})
+        return web.json_response(ss.get(range_name))
+
+    async def drive(self, request):
+        tail = request.match_info['tail']
+        if request.method == 'GET' and tail.endswith('files'):
+            q = request.query.get('q', '')
+            m = match(r'.*name = "(.*)"', q)
+            files = [{'id': ss.key, 'name': ss.title} for ss in self.spreadsheets.values()
+                     if m is None or ss.title == m.group(1)]
+            return web.json_response({'files': files})
+        if request.method == 'POST' and tail.endswith('files'):
+            body = await request.json()
+            key = self.add_spreadsheet(body['name'])
+            self.spreadsheets[key].worksheets = {'Sheet1': []}
+            return web.json_response({'id': key, 'name': body['name']})
+        if request.method == 'DELETE':
+            self.spreadsheets.pop(tail.rsplit('/', 1)[-1], None)
+            return web.Response(status=204)
+        return web.json_response({})
+
+    async def twitch(self, request):
+        tail = request.match_info['tail']
+        if tail.endswith('token'):
+            return web.json_response({
+                'access_token': 'stubaccess', 'refresh_token': 'stubrefresh',
+                'expires_in': 14400, 'scope': ['user:edit:follows'], 'token_type': 'bearer',
+            })
+        if tail.endswith('validate'):
+            return web.json_response({'client_id': 'bench', 'login': 'subbatbot', 'scopes': [], 'expires_in': 3600})
+        login = request.query.get('login', 'someone')
+        return web.json_response({'data': [{'id': str(fake_rating(login)), 'login': login}]})
@@ -1,4 +1,5 @@
 import os
+from collections import Counter
 from random import choice
 from string import Template
 import logging
@@ -9,17 +10,20 @@ import aiohttp
 from aio_lookup import ChessComAPI, LichessAPI
 from sheet import BattleSheet
 from db import SettingsDatabase
+from history import BattleHistory
+from ratings import RatingStore
+from watchdog import LoopWatchdog
+from capture import ChatRecorder
+from export import ExportServer
+from tokens import TokenManager
 from exts import checks
 from globals import DEV_MODE, USER_BLACKLIST
+from logs import setup_logging
 
 
 
-logging.basicConfig(level=logging.DEBUG)
+setup_logging()
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
-logging.getLogger('websockets').setLevel(logging.ERROR)
-logging.getLogger('twitchio').setLevel(logging.ERROR)
-logging.getLogger('urllib3').setLevel(logging.ERROR)
 
 greetings = [
     "/me Is it a bird, is it a plane, etc.",
@@ -44,19 +48,32 @@ class MissingSheetReference(KeyError):
 
 class SubBatBot(Bot):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, db=None, **kwargs):
 
         super().__init__(*args, **kwargs)
-        log.info(f"Initialized {self.nick}, dev mode = {DEV_MODE}")
+        log.info("Initialized %s, dev mode = %s", self.nick, DEV_MODE)
 
         self.load_module('exts.commands')
         self.add_check(checks.mod_or_sed)
 
         self.sheets = {}
-        self.db = SettingsDatabase()
+        self.db = db or SettingsDatabase()
+        self.history = BattleHistory(self.db)
+        self.history.load()
+        self.ratings = RatingStore(self.db)
+        self.ratings.load()
+        self.watchdog = None
+        self.tokens = None
+        # what happened to incoming messages: chatter, unknown command, blacklisted or dispatched
+        self.message_counts = Counter()
+        self.exporter = None
+        self.recorder = None
+        if os.environ.get('CHAT_CAPTURE'):
+            self.recorder = ChatRecorder(os.environ['CHAT_CAPTURE'], os.environ['BOT_PREFIX'],
+                                         [*self.commands, *self._aliases])
 
         # create a template for help message (prefix may vary)
-        public_commands = ['apply', 'set', 'clear', 'link', 'help', 'leave']
+        public_commands = ['apply', 'set', 'clear', 'pair', 'link', 'export', 'help', 'leave']
         docstrings = [cmd._callback.__doc__ for cmd in self.commands.values() if cmd.name in public_commands]
         command_help = '; '.join("${prefix}" + doc for doc in docstrings)
         self.help_msg_template = Template(f"Commands: {command_help}")
@@ -68,6 +85,11 @@ class SubBatBot(Bot):
         return sheet
 
     async def event_ready(self):
+        # optional stall detection, LOOP_WATCHDOG being the threshold in milliseconds
+        if self.watchdog is None and os.environ.get('LOOP_WATCHDOG'):
+            self.watchdog = LoopWatchdog(threshold=float(os.environ['LOOP_WATCHDOG']) / 1000)
+            self.watchdog.start()
+
         # session needs to be created in async function, hence not in __init__
         session = aiohttp.ClientSession()
         self.apis = {
@@ -78,10 +100,17 @@ class SubBatBot(Bot):
             channel_names = [self.nick]
         else:
             channel_names = self.db.get_all_channels()
-        log.debug(f"Found {len(channel_names)} channels to join")
+        log.debug("Found %s channels to join", len(channel_names))
         all_settings = self.db.get_all_settings()
         for channel_name in channel_names:
             await self.join_channel(channel_name, greet=DEV_MODE, channel_settings=all_settings[channel_name])
+        if self.tokens is None:
+            self.tokens = TokenManager(self.db)
+            self.tokens.start()
+        # signup list downloads, EXPORT_URL being where EXPORT_PORT is reachable from outside
+        if self.exporter is None and os.environ.get('EXPORT_PORT'):
+            self.exporter = ExportServer(self, int(os.environ['EXPORT_PORT']), os.environ.get('EXPORT_URL'))
+            await self.exporter.start()
         print(f"{os.environ['BOT_NICK']} is online!")
 
     async def join_channel(self, channel_name, greet=False, channel_settings=None):
@@ -91,7 +120,7 @@ class SubBatBot(Bot):
         self.sheets[channel_name] = await BattleSheet.open(channel_name, channel_settings)
         if channel_settings['sheet_key'] is None:
             sheet_key = self.sheets[channel_name].sheet_key
-            log.debug(f"({channel_name}) No sheet key in store, updating db with {sheet_key[:5]}")
+            log.debug("(%s) No sheet key in store, updating db with %s", channel_name, sheet_key[:5])
             self.db.store_key(channel_name, sheet_key)
         if greet:
             await self._ws.send_privmsg(channel_name, choice(greetings))
@@ -103,20 +132,42 @@ class SubBatBot(Bot):
         self.db.delete_channel(channel_name)
 
     async def event_message(self, msg):
+        if self.recorder is not None:
+            self.recorder.record(msg)
+        # most chat isn't for the bot, so turn it away before twitchio parses it and builds a context
+        if not self._may_be_command(msg.content):
+            return
         if msg.author.name.lower() in USER_BLACKLIST:
+            self.message_counts['blacklisted'] += 1
             return
+        self.message_counts['dispatched'] += 1
         try:
             await self.handle_commands(msg)
         except errors.MissingRequiredArgument as e:  # <-- why is this here? event_command_error is a thing.
-            log.error(f"({msg.channel.name}) Missing req argument box! {msg.author.display_name} posted {msg.content}")
-            print(e)
+            log.error("(%s) Missing req argument box! %s posted %s: %s",
+                      msg.channel.name, msg.author.display_name, msg.content, e)
+
+    def _may_be_command(self, content):
+        prefixes = self.prefixes
+        if prefixes is None:
+            # prefix not set up yet, let twitchio decide
+            return True
+        for prefix in prefixes:
+            if content.startswith(prefix):
+                words = content[len(prefix):].split(None, 1)
+                if words and (words[0] in self.commands or words[0] in self._aliases):
+                    return True
+                self.message_counts['unknown command'] += 1
+                return False
+        self.message_counts['chatter'] += 1
+        return False
 
     async def event_command_error(self, ctx, error):
         user = ctx.author
         name = user.display_name
         pre = ctx.prefix
         if isinstance(error, errors.CheckFailure):
-            log.debug(f"({ctx.channel.name}) {name} caused '{error}' by typing '{ctx.message.content}'")
+            log.debug("(%s) %s caused '%s' by typing '%s'", ctx.channel.name, name, error, ctx.message.content)
             #if str(error).endswith('mod_or_sed'):
             return
                 #msg = f"Only the {pre}apply command is available to non-moderators, sorry!"
@@ -135,14 +186,14 @@ class SubBatBot(Bot):
             elif error.param.name == 'value':
                 msg = BattleSheet.settings_help_string
             else:
-                log.debug(f"({ctx.channel.name}) {name} caused '{error}' by typing '{ctx.message.content}'")
+                log.debug("(%s) %s caused '%s' by typing '%s'", ctx.channel.name, name, error, ctx.message.content)
                 msg = str(error)
             return await ctx.send(msg)
         elif isinstance(error, MissingSheetReference):
-            log.warning(f"({ctx.channel.name}) {name} caused: {error} by typing '{ctx.message.content}'")
+            log.warning("(%s) %s caused: %s by typing '%s'", ctx.channel.name, name, error, ctx.message.content)
             return await ctx.send("No sheet found for this channel. If I just joined or rebooted, try again soon!")
         else:
-            log.error(f"({ctx.channel.name}) {name} caused '{error}' by typing '{ctx.message.content}'")
+            log.error("(%s) %s caused '%s' by typing '%s'", ctx.channel.name, name, error, ctx.message.content)
         return await super().event_command_error(ctx, error)
 
 #   @monitor to track usage stats and watch out for rate limiting
@@ -0,0 +1,103 @@
+"""
+Capture of incoming chat, for replaying real traffic against the bot in benchmarks.
+
+Only what `SubBatBot.event_message` needs is kept, in gzipped json lines with short keys:
+    t: seconds since the capture started
+    c: channel name
+    u: anonymized user name
+    m: message: the bot's commands with every argument anonymized, and anything else replaced by a placeholder
+       of the same length (after the prefix, for what only looks like a command)
+    s, f, o: subscriber, founder and moderator flags (left out when false)
+The first line holds the command prefix and start time of the capture.
+"""
+
+from datetime import datetime
+from hashlib import blake2b
+import atexit
+import logging
+import json
+import gzip
+import time
+import os
+
+
+log = logging.getLogger(__name__)
+
+
+class ChatRecorder:
+    def __init__(self, path, prefix, commands, flush_interval=5):
+        self.path = path
+        self.prefix = prefix
+        self.commands = {name.lower() for name in commands}
+        self.flush_interval = flush_interval
+        # a fresh salt per capture, so anonymized names can't be matched across captures or looked up
+        self._salt = os.urandom(16)
+        self._names = {}
+        self._start = time.monotonic()
+        self._last_flush = self._start
+        self.count = 0
+
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        header = {'prefix': prefix, 'started': datetime.utcnow().isoformat(timespec='seconds')}
+        self._file.write(json.dumps(header) + '\n')
+        atexit.register(self.close)
+        log.info("Capturing chat to %s", path)
+
+    def anonymize(self, name):
+        name = name.lower()
+        alias = self._names.get(name)
+        if alias is None:
+            alias = 'u' + blake2b(name.encode(), key=self._salt, digest_size=6).hexdigest()
+            self._names[name] = alias
+        return alias
+
+    def _scrub(self, content):
+        """Keep which commands were used, but not their arguments or what people chat about"""
+        if not content.startswith(self.prefix):
+            return 'x' * len(content)
+        command, *args = content[len(self.prefix):].split(' ')
+        if command.lower() not in self.commands:
+            return self.prefix + 'x' * (len(content) - len(self.prefix))
+        # split on single spaces, so the spacing survives
+        return ' '.join([self.prefix + command, *(self.anonymize(arg) if arg else arg for arg in args)])
+
+    def record(self, msg):
+        now = time.monotonic()
+        user = msg.author
+        entry = {
+            't': round(now - self._start, 3),
+            'c': msg.channel.name,
+            'u': self.anonymize(user.name),
+            'm': self._scrub(msg.content),
+        }
+        if user.is_subscriber:
+            entry['s'] = 1
+        if 'founder' in user.badges:
+            entry['f'] = 1
+        if user.is_mod:
+            entry['o'] = 1
+        self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self.count += 1
+        if now - self._last_flush > self.flush_interval:
+            self._file.flush()
+            self._last_flush = now
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        log.info("Captured %s messages to %s", self.count, self.path)
+
+
+def read_capture(path):
+    """Return the header and a list of entries of a capture file"""
+    entries = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        try:
+            for line in f:
+                entries.append(json.loads(line))
+        except (EOFError, json.JSONDecodeError):
+            # the bot was stopped without closing the capture, everything up to the last flush is still good
+            pass
+    return header, entries
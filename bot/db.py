@@ -4,6 +4,7 @@ PostgreSQL Database interface.
 
 import os
 import psycopg2
+from psycopg2.extras import execute_values
 
 from globals import DEV_MODE
 
@@ -13,15 +14,23 @@ class SettingsDatabase:
         'site': 'chess.com',
         'game': 'blitz',
         'format': 'none',
+        'delta': 'off',
     }
 
     def __init__(self):
+        self.conn = self._connect()
+        self.cur = self.conn.cursor()
+        # for writes from worker threads, which mustn't commit or roll back what the event loop is doing
+        self._thread_conn = None
+        self._create_history_tables()
+        self._add_setting_columns()
+
+    @staticmethod
+    def _connect():
         db_conn_string = os.environ['DATABASE_URL']
         if DEV_MODE:
-            self.conn = psycopg2.connect(db_conn_string)
-        else:
-            self.conn = psycopg2.connect(db_conn_string, sslmode='require')
-        self.cur = self.conn.cursor()
+            return psycopg2.connect(db_conn_string)
+        return psycopg2.connect(db_conn_string, sslmode='require')
 
     def add_channel(self, channel):
         defaults = SettingsDatabase.defaults
@@ -57,8 +66,9 @@ class SettingsDatabase:
             return {**SettingsDatabase.defaults, 'sheet_key': None}
 
     def get_all_settings(self):
-        self.cur.execute("SELECT * FROM settings;")
         keys = (*SettingsDatabase.defaults.keys(), 'sheet_key')
+        # columns named, since ones added later come after sheet_key in the table
+        self.cur.execute(f"SELECT channel, {', '.join(keys)} FROM settings;")
         return {t[0]: dict(zip(keys, t[1:])) for t in self.cur}
 
     def get_all_channels(self):
@@ -85,6 +95,91 @@ class SettingsDatabase:
         self.cur.execute(sql, (name,))
         return dict(zip(keys, self.cur.fetchall()[0]))
 
+    def _create_history_tables(self):
+        sql = """
+            CREATE TABLE IF NOT EXISTS battles (
+                id SERIAL PRIMARY KEY,
+                channel TEXT NOT NULL,
+                site TEXT NOT NULL,
+                game TEXT NOT NULL,
+                archived TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            CREATE TABLE IF NOT EXISTS battle_players (
+                battle_id INTEGER NOT NULL REFERENCES battles (id) ON DELETE CASCADE,
+                twitch_name TEXT NOT NULL,
+                chess_name TEXT NOT NULL,
+                site TEXT NOT NULL,
+                rating INTEGER,
+                sub BOOLEAN NOT NULL,
+                result CHAR(1)
+            );
+            CREATE INDEX IF NOT EXISTS battle_players_chess ON battle_players (site, lower(chess_name));
+            CREATE INDEX IF NOT EXISTS battle_players_twitch ON battle_players (lower(twitch_name));
+            CREATE TABLE IF NOT EXISTS ratings (
+                site TEXT NOT NULL,
+                player TEXT NOT NULL,
+                game TEXT NOT NULL,
+                recorded TIMESTAMPTZ NOT NULL,
+                rating INTEGER NOT NULL
+            );
+        """
+        self._commit(sql, ())
+
+    def _add_setting_columns(self):
+        """Add settings that came after the settings table was made"""
+        sql = "ALTER TABLE settings ADD COLUMN IF NOT EXISTS delta TEXT NOT NULL DEFAULT 'off';"
+        self._commit(sql, ())
+
+    def archive_battle(self, channel, site, game, players):
+        """Store a finished battle, with players as (twitch_name, chess_name, rating, sub, site, result) tuples"""
+        try:
+            sql = "INSERT INTO battles (channel, site, game) VALUES (%s, %s, %s) RETURNING id;"
+            self.cur.execute(sql, (channel, site, game))
+            battle_id = self.cur.fetchone()[0]
+            sql = "INSERT INTO battle_players " \
+                  "(battle_id, twitch_name, chess_name, site, rating, sub, result) VALUES %s;"
+            rows = [(battle_id, twitch_name, chess_name, player_site, rating, sub, result)
+                    for twitch_name, chess_name, rating, sub, player_site, result in players]
+            # all players in one statement
+            execute_values(self.cur, sql, rows, page_size=max(1, len(rows)))
+        except psycopg2.Error:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return battle_id
+
+    def get_archived_results(self):
+        """(site, chess_name, twitch_name, result) of every archived player"""
+        try:
+            self.cur.execute("SELECT site, chess_name, twitch_name, result FROM battle_players;")
+            return self.cur.fetchall()
+        except psycopg2.Error:
+            self.conn.rollback()
+            raise
+
+    def get_ratings(self):
+        """(site, player, game, timestamp, rating) of every recorded rating, oldest first"""
+        sql = "SELECT site, player, game, extract(epoch FROM recorded), rating FROM ratings ORDER BY recorded;"
+        try:
+            self.cur.execute(sql)
+            return [(site, player, game, float(t), rating) for site, player, game, t, rating in self.cur]
+        except psycopg2.Error:
+            self.conn.rollback()
+            raise
+
+    def add_ratings(self, points):
+        """Store (site, player, game, timestamp, rating) points. Blocks, so it's meant for a worker thread."""
+        if self._thread_conn is None or self._thread_conn.closed:
+            self._thread_conn = self._connect()
+        sql = "INSERT INTO ratings (site, player, game, recorded, rating) VALUES %s;"
+        with self._thread_conn.cursor() as cur:
+            try:
+                execute_values(cur, sql, points, template="(%s, %s, %s, to_timestamp(%s), %s)")
+            except psycopg2.Error:
+                self._thread_conn.rollback()
+                raise
+        self._thread_conn.commit()
+
     def _commit(self, sql, values):
         self.cur.execute(sql, values)
         self.conn.commit()
@@ -0,0 +1,36 @@
+"""
+Time budgets for work done on behalf of a user, like an apply.
+
+A Deadline is created when the work starts and handed to each stage, which gets whatever is left of the budget.
+A stage that runs out is cancelled and DeadlineExceeded is raised, naming the stage. That only stops work
+on the event loop, so stages that hand work to threads, like sheet writes, shouldn't run under a deadline.
+"""
+
+import asyncio
+import time
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage, budget):
+        super().__init__(f"Ran out of the {budget}s budget during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires = time.monotonic() + budget
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    async def run(self, stage, coro):
+        """Await coro, cancelling it if it's still going when the deadline passes"""
+        remaining = self.remaining()
+        if not remaining:
+            coro.close()
+            raise DeadlineExceeded(stage, self.budget)
+        try:
+            return await asyncio.wait_for(coro, remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(stage, self.budget) from None
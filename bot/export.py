@@ -0,0 +1,121 @@
+"""
+Signup lists over HTTP, for pairing tools and the like.
+
+Lists are served from the rows each BattleSheet keeps in memory, so an export doesn't use any of the
+Sheets quota that applies need, unless those rows are in doubt and have to be read again first. They're
+formatted line by line and sent in chunks as they go. Links carry a token per channel, handed out by the
+?export command.
+"""
+
+from aiohttp import web
+import secrets
+import logging
+import json
+import csv
+import io
+
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def csv_lines(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        return buffer.getvalue()
+
+    yield line(header)
+    for row in rows:
+        yield line(row)
+
+
+def ndjson_lines(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row))) + '\n'
+
+
+def chunked(lines, size=1 << 16):
+    """Join lines into chunks of about size characters"""
+    chunk, length = [], 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def signup_list(sheet):
+    """The sheet's header and a generator of its rows, subs first, with a Sub column in front"""
+    # a snapshot, since applies can come in while the list is being sent
+    entries = list(sheet.signup_rows.values())
+    header = ['Sub', *sheet.header]
+    rows = ([sub, *values] for want in (True, False) for sub, values in entries if sub == want)
+    return header, rows
+
+
+class ExportServer:
+    def __init__(self, bot, port, url=None, host='0.0.0.0'):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.url = (url or f"http://localhost:{port}").rstrip('/')
+        self.tokens = {}  # channel name -> token for its links
+        self._runner = None
+
+    def link(self, channel_name, fmt='csv'):
+        token = self.tokens.setdefault(channel_name, secrets.token_urlsafe(16))
+        return f"{self.url}/export/{channel_name}.{fmt}?token={token}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(r'/export/{channel:\w+}.{fmt:\w+}', self.export)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info("Serving exports on port %s", self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def export(self, request):
+        channel_name = request.match_info['channel']
+        fmt = request.match_info['fmt']
+        token = self.tokens.get(channel_name)
+        sheet = self.bot.sheets.get(channel_name)
+        if token is None or not secrets.compare_digest(request.query.get('token', ''), token):
+            raise web.HTTPNotFound()
+        if sheet is None or fmt not in CONTENT_TYPES:
+            raise web.HTTPNotFound()
+
+        if sheet.stale:
+            # a write that failed may have landed, so the rows in memory can't be trusted until re-read
+            try:
+                await sheet.refresh_users()
+            except Exception as e:
+                log.warning("(%s) Couldn't refresh the sheet for an export: %s", channel_name, e)
+                raise web.HTTPServiceUnavailable()
+        header, rows = signup_list(sheet)
+        lines = csv_lines(header, rows) if fmt == 'csv' else ndjson_lines(header, rows)
+        response = web.StreamResponse(headers={
+            'Content-Type': f"{CONTENT_TYPES[fmt]}; charset=utf-8",
+            'Content-Disposition': f'attachment; filename="{channel_name}.{fmt}"',
+        })
+        await response.prepare(request)
+        for chunk in chunked(lines):
+            await response.write(chunk.encode())
+        await response.write_eof()
+        log.debug("(%s) Exported the signup list as %s", channel_name, fmt)
+        return response
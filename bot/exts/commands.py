@@ -6,16 +6,34 @@ from twitch_api import add_follow, get_moderated_channels
 from globals import *
 from exts import checks
 from sheet import BattleSheet
+from scheduler import Apply, ApplyScheduler, QueueFull
+from deadline import Deadline, DeadlineExceeded
+from pairing import pair_players
+from export import CONTENT_TYPES
+from ratings import format_delta
 
+from datetime import date
+import asyncio
 import logging
+import time
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
 
 
 @cog()
 class Commands:
+    # when applies queue up further back than this the channel is told in chat, at most every notice_interval s
+    notify_position = 10
+    notice_interval = 30
+    # seconds an apply's lookups get, and how many times it's tried when they run out. The sheet write isn't
+    # bounded, since a write cut short still lands from gspread's thread, and would land again on a retry.
+    apply_budget = 20
+    apply_attempts = 2
+
     def __init__(self, bot):
         self.bot = bot
+        # applies from all channels take turns at the lookup and sheet stages
+        self.applies = ApplyScheduler(self.process_apply)
+        self._notices = {}  # channel name -> when it was last told about its apply queue
 
     @check(checks.is_bot_channel)
     @command(name='join', no_global_checks=True)
@@ -29,7 +47,7 @@ class Commands:
                            "If I'm wrong, try again later or ask Sedsarq to send the bot there.")
             return
         await ctx.send(f"Heading to /{channel_name}!")
-        log.info(f"({ctx.channel.name}) Joining {channel_name}")
+        log.info("(%s) Joining %s", ctx.channel.name, channel_name)
         await self.bot.join_channel(channel_name, greet=True)
         try:
             add_follow(username=channel_name, db=self.bot.db)
@@ -44,14 +62,34 @@ class Commands:
         if channel_name is None or ctx.author.id != SED_ID:
             channel_name = ctx.channel.name
         await self.bot.leave_channel(channel_name)
-        log.info(f"({ctx.channel.name}) Leaving {channel_name}")
+        log.info("(%s) Leaving %s", ctx.channel.name, channel_name)
 
     @command(name='clear')
     async def clear(self, ctx):
         """clear - Reset the spreadsheet"""
-        log.debug(f"({ctx.channel.name}) {ctx.author.display_name} uses ?clear")
+        log.debug("(%s) %s uses ?clear", ctx.channel.name, ctx.author.display_name)
         sheet = self.bot.get_sheet(ctx.channel.name)
+        try:
+            self.bot.history.archive(ctx.channel.name, sheet.site, sheet.game, await sheet.signups())
+        except Exception as e:
+            log.exception("(%s) Failed to archive the battle: %s", ctx.channel.name, e)
+            return await ctx.send("Couldn't save this battle to the history, so the sheet was left as is. "
+                                  "Try again in a bit!")
         await sheet.clear()
+        self.applies.forget(ctx.channel.name)
+
+    @command(name='pair')
+    async def pair(self, ctx, max_gap: int = None):
+        """pair [max_gap] - Pair subs with non-subs by rating, on a new tab"""
+        log.debug("(%s) %s uses ?pair", ctx.channel.name, ctx.author.display_name)
+        sheet = self.bot.get_sheet(ctx.channel.name)
+        subs, non_subs = await sheet.players()
+        # a big sheet takes a while to pair, which would hold up every channel on the event loop
+        loop = asyncio.get_event_loop()
+        pairing = await loop.run_in_executor(None, pair_players, subs, non_subs, max_gap)
+        await sheet.write_pairings(pairing)
+        unpaired = len(pairing.unpaired_subs) + len(pairing.unpaired_non_subs)
+        await ctx.send(f"Made {len(pairing.pairs)} pairs ({unpaired} unpaired), see the Pairings tab at {sheet.url}")
 
     @command(name='link')
     async def link(self, ctx):
@@ -61,18 +99,50 @@ class Commands:
         msg = f"Find the sheet for channel '{ctx.channel.name}' at {url}"
         await self.bot._whisper(user, msg, ctx)
 
-        log.debug(f"({ctx.channel.name}) {user} got the sheet link by whisper")
+        log.debug("(%s) %s got the sheet link by whisper", ctx.channel.name, user)
+
+    @command(name='export')
+    async def export(self, ctx, fmt='csv'):
+        """export [csv|ndjson] - Get a download link for the signup list"""
+        user = ctx.author.name
+        exporter = self.bot.exporter
+        if exporter is None:
+            msg = f"Exports aren't available right now, but the sheet is: {self.bot.get_sheet(ctx.channel.name).url}"
+        elif fmt not in CONTENT_TYPES:
+            msg = f"Available export formats: {', '.join(CONTENT_TYPES)}"
+        else:
+            msg = f"Download the signups for '{ctx.channel.name}' at {exporter.link(ctx.channel.name, fmt)}"
+        await self.bot._whisper(user, msg, ctx)
+        log.debug("(%s) %s got an export link by whisper", ctx.channel.name, user)
+
+    @command(name='history')
+    async def history(self, ctx, chess_name, days: int = None):
+        """history chess_name [days] - See how a player's rating has moved"""
+        sheet = self.bot.get_sheet(ctx.channel.name)
+        sites = ('chess.com', 'lichess') if sheet.site == 'both' else (sheet.site,)
+        start = None if days is None else time.time() - days * 86400
+        parts = []
+        for site in sites:
+            series = self.bot.ratings.get(site, chess_name, sheet.game)
+            times, ratings = series.between(start) if series else ((), ())
+            if ratings:
+                recent = ', '.join(f"{rating} ({date.fromtimestamp(t):%b %d})"
+                                   for t, rating in zip(times[-5:], ratings[-5:]))
+                parts.append(f"{site} {sheet.game} {recent}, {ratings[-1] - ratings[0]:+d} over {len(ratings)} lookups")
+        msg = '; '.join(parts) or f"no {sheet.game} ratings recorded"
+        await self.bot._whisper(ctx.author.name, f"{chess_name}: {msg}", ctx)
+        log.debug("(%s) %s looked up the rating history of %s", ctx.channel.name, ctx.author.name, chess_name)
 
     @command(name='help')
     async def help(self, ctx):
         """help - Provide some assistance"""
-        log.debug(f"({ctx.channel.name}) {ctx.author.display_name} uses ?help")
+        log.debug("(%s) %s uses ?help", ctx.channel.name, ctx.author.display_name)
         await ctx.send(self.bot.help_msg_template.substitute(prefix=ctx.prefix))
 
     @command(name='set')
     async def set(self, ctx, setting: str, value: str):
         """set setting value - Change settings. Use without arguments for current settings"""
-        log.debug(f"({ctx.channel.name}) {ctx.author.display_name} sets {setting} to {value}")
+        log.debug("(%s) %s sets %s to %s", ctx.channel.name, ctx.author.display_name, setting, value)
         channel_name = ctx.channel.name
         sheet = self.bot.get_sheet(channel_name)
         try:
@@ -93,42 +163,168 @@ class Commands:
     async def test(self, ctx, channel=None):
         pass
 
+    @check(checks.is_me)
+    @command(name='stalls', no_global_checks=True)
+    async def stalls(self, ctx):
+        watchdog = self.bot.watchdog
+        if watchdog is None:
+            return await ctx.send("Loop watchdog is not running (set LOOP_WATCHDOG to enable)")
+        worst = '; '.join(f"{culprit} {seconds:.2f}s/{count}x" for culprit, count, seconds in watchdog.top(3))
+        await self.bot._whisper(ctx.author.name, f"Worst stalls: {worst or 'none yet'}", ctx)
+
+    @check(checks.is_me)
+    @command(name='stats', no_global_checks=True)
+    async def stats(self, ctx):
+        counts = ', '.join(f"{kind} {n}" for kind, n in self.bot.message_counts.most_common())
+        applies = f"{self.applies.queued()} queued, {self.applies.active} in progress"
+        await self.bot._whisper(ctx.author.name, f"Messages: {counts}. Applies: {applies}", ctx)
+
     @command(name='apply', no_global_checks=True)
-    async def apply(self, ctx, chess_name):
-        """apply chess_name - Add user and chess stats to spreadsheet"""
+    async def apply(self, ctx, chess_name, lichess_name=None):
+        """apply chess_name [lichess_name] - Add user and chess stats to spreadsheet"""
         if chess_name == 'username':
             return
+        # fail early if there is no sheet to apply to
+        self.bot.get_sheet(ctx.channel.name)
+        try:
+            position = self.applies.submit(Apply(ctx, chess_name, lichess_name))
+        except QueueFull as e:
+            log.warning("(%s) Turned away apply by %s: %s", ctx.channel.name, ctx.author.name, e)
+            # whispered every time, since the channel notice is throttled and their apply is dropped
+            msg = "Too many applies are waiting right now, please apply again in a minute!"
+            return await self.bot._whisper(ctx.author.name, msg, ctx)
+        if position is None:
+            msg = "Got that one already, you're on the sheet with those details!"
+            await self.bot._whisper(ctx.author.name, msg, ctx)
+        elif position > self.notify_position:
+            msg = f"{position} applies are queued up, everyone gets a whisper once they're on the sheet. Hang tight!"
+            await self._queue_notice(ctx, msg)
+
+    async def _queue_notice(self, ctx, msg):
+        """Tell the channel about its apply queue in chat, rather than whispering everyone in it"""
+        now = time.monotonic()
+        if now - self._notices.get(ctx.channel.name, float('-inf')) < self.notice_interval:
+            return
+        self._notices[ctx.channel.name] = now
+        await ctx.send(msg)
+
+    async def process_apply(self, apply):
+        """Look up and add an apply to the sheet, when the scheduler gets to it"""
+        ctx = apply.ctx
+        try:
+            if await self._apply(ctx, apply.chess_name, apply.lichess_name, Deadline(self.apply_budget)):
+                self.applies.done(apply)
+        except DeadlineExceeded as e:
+            await self._retry_later(apply, e)
+        except Exception as e:
+            await self.bot.event_command_error(ctx, e)
+
+    async def _retry_later(self, apply, e):
+        ctx = apply.ctx
+        log.warning("(%s) Apply by %s, attempt %s: %s", ctx.channel.name, ctx.author.name, apply.attempts, e)
+        msg = "Sorry, your apply couldn't be processed right now. Please try again later!"
+        if apply.attempts < self.apply_attempts:
+            apply.attempts += 1
+            try:
+                self.applies.submit(apply, retry=True)
+            except QueueFull:
+                pass
+            else:
+                msg = "Your apply is taking longer than usual, so it's queued to try again. No need to re-apply!"
+        await self.bot._whisper(ctx.author.name, msg, ctx)
+
+    async def _lookup_both(self, chess_com_name, lichess_name, game_type):
+        """Look up a player on chess.com and lichess at once, with '-' for the site they aren't found on"""
+        chess_com, lichess = await asyncio.gather(
+            self.bot.apis['chess.com'].lookup(chess_com_name, game_type),
+            self.bot.apis['lichess'].lookup(lichess_name, game_type),
+            return_exceptions=True,
+        )
+        for result in (chess_com, lichess):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+        if isinstance(chess_com, Exception) and isinstance(lichess, Exception):
+            # a site that couldn't be reached says more than one that doesn't know the player
+            raise lichess if isinstance(chess_com, UserNotFound) else chess_com
+        # whatever went wrong on one site, the other one's rating is still good
+        if isinstance(chess_com, Exception):
+            if not isinstance(chess_com, UserNotFound):
+                log.warning("chess.com lookup of %s failed, going on with lichess: %s", chess_com_name, chess_com)
+            chess_com = ['-'] * 4
+        if isinstance(lichess, Exception):
+            if not isinstance(lichess, UserNotFound):
+                log.warning("lichess lookup of %s failed, going on with chess.com: %s", lichess_name, lichess)
+            lichess = ['-'] * 2
+        return [*chess_com, *lichess]
+
+    async def _apply(self, ctx, chess_name, lichess_name, deadline):
+        """Returns how the sheet changed, or None if it didn't"""
         user = ctx.author
         twitch_name = user.display_name
         sub = user.is_subscriber or 'founder' in user.badges
         sheet = self.bot.get_sheet(ctx.channel.name)
         site = sheet.site
-        api = self.bot.apis[site]
         game_type = sheet.game
         try:
+            if site == 'both':
+                lookup = self._lookup_both(chess_name, lichess_name or chess_name, game_type)
+            else:
+                lookup = self.bot.apis[site].lookup(chess_name, game_type)
             # regrabbing chess_name to (possibly) collect correct casing from lookup
-            chess_name, rating, *peak_data = await api.lookup(chess_name, game_type)
+            chess_name, rating, *site_data = await deadline.run('lookup', lookup)
         except UserNotFound:
-            msg = f"Lookup failed, couldn't find player \"{chess_name}\" on {site}!"
+            where = "chess.com or lichess" if site == 'both' else site
+            msg = f"Lookup failed, couldn't find player \"{chess_name}\" on {where}!"
             await self.bot._whisper(user.name, msg, ctx)
         except APIError as e:
-            log.error(
-                f"({ctx.channel.name}) APIError: The lookup for {site}, {game_type}, {chess_name} resulted in '{e}'")
+            log.error("(%s) APIError: The lookup for %s, %s, %s resulted in '%s'",
+                      ctx.channel.name, site, game_type, chess_name, e)
             await self.bot._whisper(user.name, str(e), ctx)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            log.exception(f"({ctx.channel.name}) Unexpected lookup fail: {site}, {game_type}, {chess_name} => {e}")
+            log.exception("(%s) Unexpected lookup fail: %s, %s, %s => %s", ctx.channel.name, site, game_type, chess_name, e)
             await ctx.send(f"Unexpected error! Who knows what happened, tbh.")
         else:
-            result = await sheet.add_data(twitch_name, chess_name, rating, *peak_data, sub=sub)
+            # what the user is told, and the sheet's formatted column shows
+            shown, record_site, note = (chess_name, rating), site, ""
+            found = [(site, chess_name, rating)]
+            if site == 'both':
+                lichess_found = site_data[-2:]
+                found = [('chess.com', chess_name, rating), ('lichess', *lichess_found)]
+                record_site = 'chess.com'
+                if chess_name == '-':
+                    shown, record_site = lichess_found, 'lichess'
+                    note = " Couldn't get your chess.com rating."
+                elif lichess_found[0] == '-':
+                    note = " Couldn't get your lichess rating."
+            shown_name, shown_rating = shown
+            change = self.bot.ratings.change(record_site, shown_name, game_type, shown_rating)
+            extras = {
+                'Battles': str(self.bot.history.record(record_site, shown_name, twitch_name)),
+                'Rating change': format_delta(change),
+            }
+            try:
+                result = await sheet.add_data(twitch_name, chess_name, rating, *site_data,
+                                              sub=sub, extras=extras, shown=shown)
+            except Exception:
+                # the write may have landed anyway, so the row numbers we know of are in doubt
+                sheet.stale = True
+                raise
+            # every rating that made it onto the sheet goes into the rating history
+            for found_site, name, found_rating in found:
+                if name != '-':
+                    self.bot.ratings.add(found_site, name, game_type, found_rating)
             status = "subscriber" if sub else "non-subscriber"
             if result == 'new':
-                msg = f"Thanks for applying! {chess_name} ({rating}) is now on the sheet, marked as {status}."
+                msg = f"Thanks for applying! {shown_name} ({shown_rating}) is now on the sheet, marked as {status}."
             elif result == 'updated':
-                msg = f"Your details were updated to: {chess_name} ({rating})."
+                msg = f"Your details were updated to: {shown_name} ({shown_rating})."
             elif result == 'moved':
-                msg = f"Your sub status has changed! {chess_name} ({rating}) is now marked as a {status}."
+                msg = f"Your sub status has changed! {shown_name} ({shown_rating}) is now marked as a {status}."
             else:
-                log.error(
-                    f"bot.apply: The result {result} from add_data is not being handled! No message sent to {twitch_name}.")
-                return
-            await self.bot._whisper(user.name, msg, ctx)
\ No newline at end of file
+                log.error("bot.apply: The result %s from add_data is not being handled! No message sent to %s.",
+                          result, twitch_name)
+                return result
+            await self.bot._whisper(user.name, msg + note, ctx)
+            return result
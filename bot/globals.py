@@ -7,4 +7,4 @@ SBBD_ID = 572514237
 
 # twitch usernames which are skipped if trying to use a command. bots should be skipped so
 # they can't be used to sneakily access mod commands
-USER_BLACKLIST = ['moobot', 'nightbot', environ['BOT_NICK'].lower()]
\ No newline at end of file
+USER_BLACKLIST = frozenset(['moobot', 'nightbot', environ['BOT_NICK'].lower()])
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Past sub battles, for showing applicants' battle records.
+
+Each battle's signups are archived to the database when the sheet is cleared. Every archived player's
+result is also kept in memory, read once at startup and added to with each archive, so an apply can look up
+its record by chess account or twitch name without waiting on the database.
+"""
+
+from collections import defaultdict
+import logging
+
+from sheet import rating_columns, find_rating
+
+
+log = logging.getLogger(__name__)
+
+RESULTS = {
+    'w': 'W', 'win': 'W', 'won': 'W', '1': 'W',
+    'l': 'L', 'loss': 'L', 'lost': 'L', '0': 'L',
+    'd': 'D', 'draw': 'D', '½': 'D', '0.5': 'D', '1/2': 'D',
+}
+
+
+def parse_result(value):
+    """W, L or D from a result cell, or None if there isn't one"""
+    return RESULTS.get(str(value).strip().lower())
+
+
+class PlayerRecord:
+    __slots__ = ('battles', 'wins', 'losses', 'draws')
+
+    def __init__(self, results):
+        self.battles = len(results)
+        self.wins = results.count('W')
+        self.losses = results.count('L')
+        self.draws = results.count('D')
+
+    def __str__(self):
+        if not self.battles:
+            return ''
+        battles = f"{self.battles} battle{'s' if self.battles > 1 else ''}"
+        if self.wins + self.losses + self.draws:
+            return f"{battles}, {self.wins}W {self.losses}L {self.draws}D"
+        return battles
+
+
+class BattleHistory:
+    def __init__(self, db):
+        self.db = db
+        self._results = []  # result of every archived player, None where the sheet had none
+        self._by_chess = defaultdict(list)  # (site, chess name lowercased) -> indices into _results
+        self._by_twitch = defaultdict(list)  # twitch name lowercased -> indices into _results
+        self.loaded = False
+
+    def load(self):
+        """Read the results of past battles into memory. Until it succeeds, records only cover new battles."""
+        try:
+            players = self.db.get_archived_results()
+        except Exception as e:
+            log.error("Couldn't load the battle history: %s", e)
+            return False
+        self._results = []
+        self._by_chess.clear()
+        self._by_twitch.clear()
+        for site, chess_name, twitch_name, result in players:
+            self._add(site, chess_name, twitch_name, result)
+        self.loaded = True
+        log.info("Loaded the results of %s archived players", len(self._results))
+        return True
+
+    def _add(self, site, chess_name, twitch_name, result):
+        self._by_chess[site, chess_name.lower()].append(len(self._results))
+        self._by_twitch[twitch_name.lower()].append(len(self._results))
+        self._results.append(result)
+
+    def record(self, site, chess_name, twitch_name):
+        by_chess = self._by_chess.get((site, chess_name.lower()), ())
+        by_twitch = self._by_twitch.get(twitch_name.lower(), ())
+        return PlayerRecord([self._results[i] for i in sorted({*by_chess, *by_twitch})])
+
+    def archive(self, channel_name, site, game, signups):
+        """Store the signups of a finished battle, as (sub, header, rows) for each worksheet.
+
+        Each player is archived under the first site they have a rating for, with the result from a
+        "Result" column if the sheet has one. Returns the number of players archived.
+        """
+        players = []
+        for sub, header, rows in signups:
+            titles = [title.strip().lower() for title in header]
+            columns = rating_columns(titles)
+            result_col = titles.index('result') if 'result' in titles else None
+            for row in rows:
+                rating, col = find_rating(row, columns)
+                if rating is None:
+                    # the name that goes with the rating is the column before it, titled by site
+                    col, player_site = 2, site
+                else:
+                    player_site = titles[col - 1] if titles[col - 1] in ('chess.com', 'lichess') else site
+                chess_name = cell(row, col - 1)
+                if not cell(row, 0) or chess_name in ('', '-'):
+                    continue
+                result = parse_result(cell(row, result_col))
+                players.append((row[0], chess_name, rating, sub, player_site, result))
+        if not players:
+            return 0
+        self.db.archive_battle(channel_name, site, game, players)
+        # a history that never loaded gets another go, which takes in this battle as well
+        if self.loaded or not self.load():
+            for twitch_name, chess_name, _, _, player_site, result in players:
+                self._add(player_site, chess_name, twitch_name, result)
+        log.info("(%s) Archived a battle with %s players", channel_name, len(players))
+        return len(players)
+
+
+def cell(row, col):
+    if col is None or col >= len(row):
+        return ''
+    return row[col]
@@ -0,0 +1,106 @@
+"""
+Logging setup for the bot.
+
+Records are handed to a queue on the thread that logs them and written out by a background thread, so a
+slow stdout never holds up the event loop. Formatting happens on that thread as well, which only pays off
+with lazy %-style messages, like log.debug("Added %s", name).
+
+Levels come from the environment: LOG_LEVEL for everything (DEBUG by default), and LOG_LEVELS for single
+loggers, as in LOG_LEVELS="sheet=INFO,gspread_asyncio=WARNING". Warnings and errors that repeat, like a
+storm of 429s, are let through a few times a minute and then summed up.
+"""
+
+from logging.handlers import QueueHandler, QueueListener
+import logging
+import atexit
+import queue
+import time
+import sys
+import os
+
+
+# chatty libraries, unless LOG_LEVELS says otherwise
+DEFAULT_LEVELS = {
+    'websockets': 'ERROR',
+    'twitchio': 'ERROR',
+    'urllib3': 'ERROR',
+}
+
+_listener = None
+
+
+class RepeatFilter(logging.Filter):
+    """Let through the first `burst` records with the same logger, level and message template in each
+    `window` seconds, then keep count of the rest and mention them with the next one let through.
+
+    Records below `level` always pass.
+    """
+
+    def __init__(self, burst=5, window=60.0, level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self._seen = {}  # (logger, level, template) -> [window start, count]
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = record.name, record.levelno, str(record.msg)
+        now = time.monotonic()
+        seen = self._seen.get(key)
+        if seen is None or now - seen[0] >= self.window:
+            suppressed = seen[1] - self.burst if seen is not None and seen[1] > self.burst else 0
+            if len(self._seen) > 1000:
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window}
+            self._seen[key] = [now, 1]
+            if suppressed:
+                record.msg = f"{record.msg} [{suppressed} more like this in the last {self.window:.0f}s]"
+            return True
+        seen[1] += 1
+        return seen[1] <= self.burst
+
+
+class ThreadQueueHandler(QueueHandler):
+    """QueueHandler for a queue read by a thread in the same process.
+
+    The stock one formats records before queueing them, so they can be pickled. Records here only cross
+    threads, so the formatting is left to the listener.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def parse_levels(spec):
+    """{'sheet': 'INFO'} from 'sheet=INFO', with entries separated by commas"""
+    levels = {}
+    for entry in spec.split(','):
+        if '=' in entry:
+            name, level = entry.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(stream=None):
+    """Send all logging through a background thread, with levels from the environment"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    records = queue.SimpleQueue()
+    handler = ThreadQueueHandler(records)
+    handler.addFilter(RepeatFilter())
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(os.environ.get('LOG_LEVEL', 'DEBUG').upper())
+    levels = {**DEFAULT_LEVELS, **parse_levels(os.environ.get('LOG_LEVELS', ''))}
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,114 @@
+"""
+Rating-based pairing of subs against non-subs, with the smallest total rating gap.
+
+With both sides sorted by rating, some optimal pairing never has two pairs crossing each other. When the
+sides are the same size that makes pairing by rank optimal. Otherwise the players of the larger side who sit
+out are picked by dynamic programming over the sorted lists, where each player's partner is looked for within
+WINDOW places of where their rating sorts into the other side. That's O(n log n + n·WINDOW), and exact
+whenever the sides differ by at most WINDOW players. With a maximum gap, players are split wherever
+neighbouring ratings are further apart than it and each group is paired on its own, and pairs still too
+far apart are left unpaired.
+"""
+
+from bisect import bisect_left
+from itertools import accumulate, repeat
+from operator import add, eq, itemgetter, sub
+
+
+WINDOW = 50  # places either side of its rating a player's partner is looked for, see match_sorted
+
+
+class Pairing:
+    def __init__(self, pairs, unpaired_subs, unpaired_non_subs):
+        self.pairs = pairs  # list of (sub, non_sub), each a (rating, player) tuple
+        self.unpaired_subs = unpaired_subs
+        self.unpaired_non_subs = unpaired_non_subs
+
+    @property
+    def total_gap(self):
+        return sum(abs(sub[0] - non_sub[0]) for sub, non_sub in self.pairs)
+
+
+def match_sorted(small, large, window=WINDOW):
+    """Indices (i, j) pairing every rating in small with one in large, both sorted, for the smallest total gap.
+
+    Exact when large has at most window more ratings than small. Otherwise small[i]'s partner is looked
+    for among window places either side of where its rating sorts into large, never before where small[i-1]'s
+    search started and never more than 2 * window + 1 places.
+    """
+    n, k = len(small), len(large) - len(small)
+    if not k:
+        return [(i, i) for i in range(n)]
+    # best[s - lo]: smallest gap of pairing the first i of small with the first i + s of large, s of which
+    # sit out, for s from lo to hi in row i. Sitting out more than hi costs nothing extra. Sitting out
+    # fewer than in the row before isn't possible, so lo never goes down.
+    best, lo, hi = [0], 0, 0
+    rows = []  # (lo, hi, whether large[i + s] plays small[i] in that best) for every i
+    for i, rating in enumerate(small):
+        center = min(k, max(0, bisect_left(large, rating) - i))
+        row_lo = min(k, max(lo, center - window))
+        row_hi = min(k, row_lo + 2 * window, max(hi, center + window))
+        before = best[row_lo - lo:row_hi + 1 - lo] + best[-1:] * (row_hi - max(row_lo, hi + 1) + 1)
+        gaps = map(abs, map(sub, repeat(rating), large[i + row_lo:i + row_hi + 1]))
+        with_pair = list(map(add, before, gaps))
+        best = list(accumulate(with_pair, min))
+        rows.append((row_lo, row_hi, bytes(map(eq, with_pair, best))))
+        lo, hi = row_lo, row_hi
+
+    matches = []
+    i, s = n, k
+    while i:
+        row_lo, row_hi, paired = rows[i - 1]
+        s = min(s, row_hi)
+        if paired[s - row_lo]:
+            i -= 1
+            matches.append((i, i + s))
+        else:
+            s -= 1
+    matches.reverse()
+    return matches
+
+
+def pair_players(subs, non_subs, max_gap=None):
+    """Pair up (rating, player) tuples from both sides by rating"""
+    subs = sorted(subs, key=itemgetter(0))
+    non_subs = sorted(non_subs, key=itemgetter(0))
+    entries = sorted([(rating, True, i) for i, (rating, _) in enumerate(subs)]
+                     + [(rating, False, j) for j, (rating, _) in enumerate(non_subs)])
+    # no pair within the maximum gap can span a wider step between neighbouring ratings, so each run of
+    # players without one is paired on its own
+    groups, group = [], []
+    for entry in entries:
+        if group and max_gap is not None and entry[0] - group[-1][0] > max_gap:
+            groups.append(group)
+            group = []
+        group.append(entry)
+    groups.append(group)
+
+    matches = []
+    for group in groups:
+        sub_side = [i for _, is_sub, i in group if is_sub]
+        non_sub_side = [j for _, is_sub, j in group if not is_sub]
+        if len(sub_side) <= len(non_sub_side):
+            matched = match_sorted([subs[i][0] for i in sub_side], [non_subs[j][0] for j in non_sub_side])
+            matches += [(sub_side[a], non_sub_side[b]) for a, b in matched]
+        else:
+            matched = match_sorted([non_subs[j][0] for j in non_sub_side], [subs[i][0] for i in sub_side])
+            matches += [(sub_side[b], non_sub_side[a]) for a, b in matched]
+    if max_gap is not None:
+        matches = [(i, j) for i, j in matches if abs(subs[i][0] - non_subs[j][0]) <= max_gap]
+
+    pairs = [(subs[i], non_subs[j]) for i, j in matches]
+    paired_subs = {i for i, _ in matches}
+    paired_non_subs = {j for _, j in matches}
+    unpaired_subs = [entry for i, entry in enumerate(subs) if i not in paired_subs]
+    unpaired_non_subs = [entry for j, entry in enumerate(non_subs) if j not in paired_non_subs]
+    return Pairing(pairs, unpaired_subs, unpaired_non_subs)
+
+
+def parse_rating(value):
+    """Rating from a sheet cell, or None if there isn't one"""
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return None
@@ -0,0 +1,109 @@
+"""
+Rating history of applicants, to see how a player's rating moves between applies.
+
+Every rating an apply puts on the sheet is appended to a series for its (site, player, game type). A series
+keeps times and ratings in two arrays, about 10 bytes a point, sorted by time so ranges are found by
+bisection. The points are stored in the database as well: all of them are read once at startup, and new
+ones are written in batches from a worker thread, so applies never wait on the database.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+import asyncio
+import logging
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class RatingSeries:
+    __slots__ = ('times', 'ratings')
+
+    def __init__(self, points=()):
+        self.times = array('d')
+        self.ratings = array('H')
+        for t, rating in points:
+            self.append(rating, t)
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, rating, t=None):
+        t = time.time() if t is None else t
+        if self.times and t < self.times[-1]:
+            # clocks can step back, but the series has to stay sorted
+            t = self.times[-1]
+        self.times.append(t)
+        self.ratings.append(rating)
+        return t
+
+    def between(self, start=None, end=None):
+        """(times, ratings) of the points from start to end, inclusive"""
+        i = 0 if start is None else bisect_left(self.times, start)
+        j = len(self.times) if end is None else bisect_right(self.times, end)
+        return self.times[i:j], self.ratings[i:j]
+
+
+class RatingStore:
+    def __init__(self, db):
+        self.db = db
+        self._series = {}  # (site, player name lowercased, game type) -> RatingSeries
+        self._unsaved = []  # (site, player, game type, time, rating) not in the database yet
+        self._saving = None
+
+    def load(self):
+        """Read the stored ratings into memory. Until it succeeds, series only hold ratings added since."""
+        try:
+            points = self.db.get_ratings()
+        except Exception as e:
+            log.error("Couldn't load the rating history: %s", e)
+            return False
+        for site, player, game, t, rating in points:
+            key = site, player.lower(), game
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = RatingSeries()
+            series.append(rating, t)
+        log.info("Loaded %s ratings of %s players", len(points), len(self._series))
+        return True
+
+    def get(self, site, player, game):
+        """The player's series, or None if nothing was recorded for them"""
+        return self._series.get((site, player.lower(), game))
+
+    def change(self, site, player, game, rating):
+        """How far rating is from the first one recorded for the player, or None if there's none yet"""
+        series = self.get(site, player, game)
+        if not series or not isinstance(rating, int):
+            return None
+        return rating - series.ratings[0]
+
+    def add(self, site, player, game, rating):
+        """Record a looked up rating, to be saved to the database in the background"""
+        if not isinstance(rating, int):
+            return
+        key = site, player.lower(), game
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = RatingSeries()
+        t = series.append(rating)
+        self._unsaved.append((site, player.lower(), game, t, rating))
+        if self._saving is None or self._saving.done():
+            self._saving = asyncio.ensure_future(self._save())
+
+    async def _save(self):
+        # ratings added while a batch is being written go in the next one
+        loop = asyncio.get_event_loop()
+        while self._unsaved:
+            points, self._unsaved = self._unsaved, []
+            try:
+                await loop.run_in_executor(None, self.db.add_ratings, points)
+            except Exception as e:
+                log.error("Couldn't save %s ratings: %s", len(points), e)
+
+
+def format_delta(delta):
+    if delta is None:
+        return ''
+    return f"{delta:+d}"
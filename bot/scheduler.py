@@ -0,0 +1,153 @@
+"""
+Fair admission of applies to the lookup and sheet stages.
+
+Each channel gets its own queue and the queues take turns, so a huge battle in one channel can't starve
+the applies of a small one. Repeat applies from a user whose apply is still waiting update it in place,
+and identical applies right after one made it onto the sheet are turned away.
+"""
+
+from collections import deque
+import asyncio
+import logging
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Apply:
+    __slots__ = ('ctx', 'chess_name', 'lichess_name', 'submitted', 'attempts')
+
+    def __init__(self, ctx, chess_name, lichess_name=None):
+        self.ctx = ctx
+        self.chess_name = chess_name
+        self.lichess_name = lichess_name  # when different from chess_name, for sheets with both sites
+        self.submitted = time.monotonic()
+        self.attempts = 1
+
+    @property
+    def key(self):
+        return self.ctx.channel.name, self.ctx.author.name
+
+    @property
+    def details(self):
+        """What the sheet would show for this apply, to tell repeats apart"""
+        author = self.ctx.author
+        sub = bool(author.is_subscriber or 'founder' in author.badges)
+        return self.chess_name.lower(), (self.lichess_name or '').lower(), sub
+
+    @property
+    def channel_name(self):
+        return self.ctx.channel.name
+
+
+class ApplyScheduler:
+    def __init__(self, handler, workers=4, max_queued=500, debounce=10):
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued  # per channel
+        self.debounce = debounce  # seconds
+
+        self.queues = {}  # channel name -> deque of waiting applies
+        self.turns = deque()  # channels with waiting applies, in serving order
+        self.waiting = {}  # (channel name, user name) -> Apply in a queue
+        self.recent = {}  # (channel name, user name) -> (details, time) of the last apply written to the sheet
+
+        self.active = 0  # applies being handled right now
+        self._wakeup = None
+        self._idle = None
+        self._tasks = []
+
+    def submit(self, apply, retry=False):
+        """Queue an apply, and return its position in the channel's queue.
+
+        Returns None if the apply repeats one that was just written to the sheet (unless it's a retry),
+        and raises QueueFull if the channel already has max_queued applies waiting.
+        """
+        if not self._tasks:
+            self._start()
+        key = apply.key
+        waiting = self.waiting.get(key)
+        if waiting is not None:
+            # newest details win, but the user keeps their place in line
+            waiting.ctx = apply.ctx
+            waiting.chess_name = apply.chess_name
+            waiting.lichess_name = apply.lichess_name
+            return self.queues[apply.channel_name].index(waiting) + 1
+
+        last = None if retry else self.recent.get(key)
+        if last is not None:
+            details, written = last
+            if details == apply.details and apply.submitted - written < self.debounce:
+                return None
+
+        queue = self.queues.get(apply.channel_name)
+        if queue is None:
+            queue = self.queues[apply.channel_name] = deque()
+            self.turns.append(apply.channel_name)
+        elif len(queue) >= self.max_queued:
+            raise QueueFull(f"{len(queue)} applies already waiting in {apply.channel_name}")
+        queue.append(apply)
+        self.waiting[key] = apply
+        self._idle.clear()
+        self._wakeup.set()
+        return len(queue)
+
+    def done(self, apply):
+        """Note that an apply made it onto the sheet, so the same one right after can be turned away"""
+        now = time.monotonic()
+        if len(self.recent) > 10000:
+            self.recent = {k: v for k, v in self.recent.items() if now - v[1] < self.debounce}
+        self.recent[apply.key] = apply.details, now
+
+    def forget(self, channel_name):
+        """Stop turning away repeats in a channel, like after its sheet was cleared"""
+        self.recent = {k: v for k, v in self.recent.items() if k[0] != channel_name}
+
+    def queued(self, channel_name=None):
+        if channel_name is None:
+            return len(self.waiting)
+        return len(self.queues.get(channel_name, ()))
+
+    async def join(self):
+        """Wait until every queued apply has been handled"""
+        if self._tasks:
+            await self._idle.wait()
+
+    def _start(self):
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    def _next(self):
+        """Take the first apply of the channel whose turn it is"""
+        channel_name = self.turns.popleft()
+        queue = self.queues[channel_name]
+        apply = queue.popleft()
+        if queue:
+            self.turns.append(channel_name)
+        else:
+            del self.queues[channel_name]
+        del self.waiting[apply.key]
+        return apply
+
+    async def _work(self):
+        while True:
+            if not self.turns:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            apply = self._next()
+            self.active += 1
+            try:
+                await self.handler(apply)
+            except Exception as e:
+                log.exception("(%s) Apply by %s failed: %s", apply.channel_name, apply.ctx.author.name, e)
+            finally:
+                self.active -= 1
+                if not self.active and not self.waiting:
+                    self._idle.set()
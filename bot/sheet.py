@@ -9,14 +9,19 @@ from oauth2client import crypt, GOOGLE_REVOKE_URI
 
 import gspread_asyncio
 import gspread
+import gspread.urls
 
 from collections import Counter
+from datetime import datetime
+from itertools import zip_longest
 import asyncio
 from re import search
 import os
 import logging
 import time
 
+from pairing import parse_rating
+
 
 asyncgspread = logging.getLogger('gspread_asyncio')
 log = logging.getLogger(__name__)
@@ -39,6 +44,22 @@ def get_creds():
     return credentials
 
 
+def rating_columns(header):
+    """Columns of a sheet header that hold current ratings, so not peak ratings"""
+    return [i for i, title in enumerate(header)
+            if title.lower().endswith('rating') and not title.lower().startswith('peak')]
+
+
+def find_rating(row, columns):
+    """First rating in the given columns of a row and its column, or (None, None) if there's none"""
+    for col in columns:
+        if col < len(row):
+            rating = parse_rating(row[col])
+            if rating is not None:
+                return rating, col
+    return None, None
+
+
 class CustomAGCM(gspread_asyncio.AsyncioGspreadClientManager):
     """Subclassed manager for logging access.
 
@@ -46,6 +67,8 @@ class CustomAGCM(gspread_asyncio.AsyncioGspreadClientManager):
     gspread_errors = Counter()
     ratelim_bin = None
     ratelim_count = None
+    _refresh_task = None
+    expires = None  # loop time the current credentials run out
 
     async def before_gspread_call(self, method, args, kwargs):
         """Using this prelude to see if I can track the rate limit from this altitude,
@@ -67,35 +90,68 @@ class CustomAGCM(gspread_asyncio.AsyncioGspreadClientManager):
             # noticed = self.ratelim_count >= 100
             delay = 30
             asyncgspread.error(
-                f"Gspread Error, rate limit hit! Recorded calls: {self.ratelim_count}/100. Was calling {method.__name__} {args} {kwargs}. Sleeping for {delay} seconds."
+                "Gspread Error, rate limit hit! Recorded calls: %s/100. Was calling %s %s %s. Sleeping for %s seconds.",
+                self.ratelim_count, method.__name__, args, kwargs, delay
             )
         else:
             delay = self.gspread_delay
             asyncgspread.error(
-                f"Gspread Error {e} while calling {method.__name__} {args} {kwargs}. Sleeping for {delay} seconds."
+                "Gspread Error %s while calling %s %s %s. Sleeping for %s seconds.", e, method.__name__, args, kwargs, delay
             )
         await asyncio.sleep(delay)
 
     async def handle_requests_error(self, e, method, args, kwargs):
         asyncgspread.error(
-            f"Req Error {e} while calling {method.__name__} {args} {kwargs}. Sleeping for {self.gspread_delay} seconds."
+            "Req Error %s while calling %s %s %s. Sleeping for %s seconds.", e, method.__name__, args, kwargs,
+            self.gspread_delay
         )
         await asyncio.sleep(self.gspread_delay)
 
     async def _authorize(self):
         now = self._loop.time()
-        if self.auth_time is None or self.auth_time + self.reauth_interval < now:
-            creds = await self._loop.run_in_executor(None, self.credentials_fn)
-            gc = await self._loop.run_in_executor(None, gspread.authorize, creds)
+        if self.auth_time is None or self.expires <= now:
+            # normally the background refresh gets here first, see tokens.py
+            return await self.refresh()
+        return self._agc_cache[self.auth_time]
+
+    async def refresh(self):
+        """Authorize with fresh credentials. Calls made while a refresh is underway wait for that same refresh."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self):
+        creds = await self._loop.run_in_executor(None, self.credentials_fn)
+        gc = await self._loop.run_in_executor(None, gspread.authorize, creds)
+        # get the access token now, instead of on the first request made with it
+        await self._loop.run_in_executor(None, gc.login)
+        agc = self._agc_cache.get(self.auth_time)
+        if agc is None:
             agc = CustomAGC(self, gc)
-            self._agc_cache[now] = agc
-            if self.auth_time in self._agc_cache:
-                del self._agc_cache[self.auth_time]
-            self.auth_time = now
         else:
-            agc = self._agc_cache[self.auth_time]
+            # swap the credentials into the client that all cached spreadsheets hold on to, keeping the caches
+            agc.gc.auth, agc.gc.session = gc.auth, gc.session
+        now = self._loop.time()
+        self._agc_cache = {now: agc}
+        self.auth_time = now
+        self.expires = self._expiry(gc.auth, now)
+        asyncgspread.debug("Refreshed Google credentials")
         return agc
 
+    def _expiry(self, auth, now):
+        """Loop time credentials run out, going by the token's own expiry where it has one"""
+        token_expiry = getattr(auth, 'token_expiry', None)  # naive UTC, set by login
+        if token_expiry is None:
+            # gspread_asyncio keeps reauth_interval in seconds, though it's passed in minutes
+            return now + self.reauth_interval
+        return now + (token_expiry - datetime.utcnow()).total_seconds()
+
+    def seconds_left(self):
+        """Seconds until the current credentials run out, or 0 if there are none"""
+        if self.auth_time is None or self._loop is None:
+            return 0
+        return max(0, self.expires - self._loop.time())
+
 
 class CustomAGC(gspread_asyncio.AsyncioGspreadClient):
     """
@@ -118,10 +174,13 @@ agcm = CustomAGCM(get_creds)
 
 
 class BattleSheet:
+    signup_titles = ('Subs', 'Not subs')
+    pairings_title = 'Pairings'
     settings_help_string = "Available settings: " \
-                           "?set site lichess (or chess.com); " \
+                           "?set site lichess (or chess.com, or both); " \
                            "?set game bullet (or rapid, or blitz)" \
-                           "?set format bracket (or space, or none); "
+                           "?set format bracket (or space, or none); " \
+                           "?set delta on (or off) for a rating change column; "
 
     def __init__(self, channel_name, settings):
         # Better to create through the async open method, which includes the actual sheet object
@@ -134,6 +193,10 @@ class BattleSheet:
         # dict of {username.lower(): (worksheet_title, row_nr)}.
         # Lowercase names to avoid multiple entries by changing display_name
         self.users_on_sheet = {}
+        # dict of {username.lower(): (sub, row_values)}, in sheet order, so the list can be read without the API
+        self.signup_rows = {}
+        # set when a write may or may not have gone through, so users_on_sheet can't be trusted
+        self.stale = False
         self.sheet_key = settings.get('sheet_key')
         self.url = None
 
@@ -141,16 +204,29 @@ class BattleSheet:
         self.format = settings['format']
         self.site = settings['site']
         self.game = settings['game']
+        self.delta = settings['delta']
 
         if self.sheet_key is None:
             settings_summary = ', '.join(f'{key}={value}' for key, value in settings.items())
         else:
             settings_summary = ', '.join(f'{key}={value:.9}' for key, value in settings.items())
-        log.info(f"{channel_name}: Initialized BattleSheet with {settings_summary}")
+        log.info("%s: Initialized BattleSheet with %s", channel_name, settings_summary)
+
+    @property
+    def extra_columns(self):
+        """Columns after the site's own, filled in from what the bot knows rather than from the lookup"""
+        columns = ['Battles']
+        if self.delta == 'on':
+            columns.append('Rating change')
+        return columns
+
+    @property
+    def header(self):
+        return self._header_data['values'][0]
 
     @property
     def current_settings(self):
-        return f"site={self.site}, game={self.game}, format={self.format}"
+        return f"site={self.site}, game={self.game}, format={self.format}, delta={self.delta}"
 
     @classmethod
     async def open(cls, channel_name, settings):
@@ -164,11 +240,16 @@ class BattleSheet:
         """Prepare data used to refresh the sheet header"""
         rating_title = f"{self.game} rating".capitalize()
         if self.site == 'chess.com':
-            header = ['Twitch', 'Chess.com', rating_title, 'Formatted', 'Peak rating', 'Peak date']
+            site_columns = ['Chess.com', rating_title, 'Formatted', 'Peak rating', 'Peak date']
         elif self.site == 'lichess':
-            header = ['Twitch', 'Lichess', rating_title, 'Formatted']
+            site_columns = ['Lichess', rating_title, 'Formatted']
+        elif self.site == 'both':
+            # chess.com's columns as usual, with lichess tacked on
+            site_columns = ['Chess.com', f"Chess.com {self.game} rating", 'Formatted', 'Peak rating', 'Peak date',
+                            'Lichess', f"Lichess {self.game} rating"]
         else:
             raise ValueError("Unknown site")
+        header = ['Twitch', *site_columns, *self.extra_columns]
         self.last_col = chr(64 + len(header))
         self._header_data = {
             'range': f"A1:{self.last_col}1",
@@ -183,7 +264,7 @@ class BattleSheet:
             else:
                 self.sheet = await agc.open(self.channel_name)
         except gspread.exceptions.SpreadsheetNotFound:
-            log.info(f"{self.channel_name}: Didn't find sheet, making new")
+            log.info("%s: Didn't find sheet, making new", self.channel_name)
             self.sheet = await self.new_sheet(self.channel_name)
             await self.refresh_headers()
         self.url = self.sheet.ss.url
@@ -206,15 +287,15 @@ class BattleSheet:
         if value not in formats:
             raise ValueError("Available formats: " + ', '.join(formats))
         self.format = value
-        log.debug(f"{self.channel_name}: Switched format to {value}")
+        log.debug("%s: Switched format to %s", self.channel_name, value)
 
     async def set_site(self, value):
         if value == self.site:
             return
-        if value not in ('chess.com', 'lichess'):
-            raise ValueError(f"{value} is not an available site. Try lichess or chess.com")
+        if value not in ('chess.com', 'lichess', 'both'):
+            raise ValueError(f"{value} is not an available site. Try lichess, chess.com or both")
         self.site = value
-        log.debug(f"{self.channel_name:} Switched site to {value}")
+        log.debug("%s: Switched site to %s", self.channel_name, value)
         self._create_header_data()
         await self.refresh_headers()
 
@@ -225,18 +306,39 @@ class BattleSheet:
         if value not in game_types:
             raise ValueError(f"Available game types are {', '.join(game_types)}")
         self.game = value
-        log.debug(f"{self.channel_name}: Switched game to {value}")
+        log.debug("%s: Switched game to %s", self.channel_name, value)
+        self._create_header_data()
+        await self.refresh_headers()
+
+    async def set_delta(self, value):
+        if value == self.delta:
+            return
+        if value not in ('on', 'off'):
+            raise ValueError("Use on or off")
+        self.delta = value
+        log.debug("%s: Switched rating change column %s", self.channel_name, value)
         self._create_header_data()
         await self.refresh_headers()
 
-    async def add_data(self, twitch_name, chess_name, rating, *peak_values, sub=True):
+    def row_values(self, twitch_name, chess_name, rating, *site_values, extras=None, shown=None):
+        """A user's row. site_values are the lookup's values after the rating, extras the values of
+        extra_columns by title, and shown the (name, rating) to format, if not chess_name and rating."""
+        shown_name, shown_rating = shown or (chess_name, rating)
         if self.format == 'none':
             format_name = '-'
         elif self.format == 'bracket':
-            format_name = f"{chess_name} ({rating})"
+            format_name = f"{shown_name} ({shown_rating})"
         elif self.format == 'space':
-            format_name = f"{chess_name} {rating}"
-        row_values = [twitch_name, chess_name, rating, format_name, *peak_values]
+            format_name = f"{shown_name} {shown_rating}"
+        extras = extras or {}
+        extra_values = [extras.get(title, '') for title in self.extra_columns]
+        return [twitch_name, chess_name, rating, format_name, *site_values, *extra_values]
+
+    async def add_data(self, twitch_name, chess_name, rating, *site_values, sub=True, extras=None, shown=None):
+        """Add or update a user's row, see row_values"""
+        row_values = self.row_values(twitch_name, chess_name, rating, *site_values, extras=extras, shown=shown)
+        if self.stale:
+            await self.refresh_users()
         agc = await agcm.authorize()
         sheet = await agc.open(self.channel_name)
         if sub:
@@ -256,13 +358,18 @@ class BattleSheet:
             else:
                 prev_ws = await sheet.worksheet(prev_ws_title)
                 await prev_ws.delete_row(prev_row_nr)
-                log.debug(f"{self.channel_name}:{prev_ws_title}:{prev_row_nr} Removed user {twitch_name}:{chess_name}")
+                log.debug("%s:%s:%s Removed user %s:%s", self.channel_name, prev_ws_title, prev_row_nr, twitch_name, chess_name)
                 await self._append(ws, twitch_name, row_values)
                 res = "moved"
         # append new row
         else:
             await self._append(ws, twitch_name, row_values)
             res = "new"
+
+        key = twitch_name.lower()
+        if res == 'moved':
+            del self.signup_rows[key]  # to the end of the list, like on the sheet
+        self.signup_rows[key] = bool(sub), row_values
         return res
 
     async def _append(self, ws, user_name, values):
@@ -270,17 +377,17 @@ class BattleSheet:
         ret = await ws.append_row(values)
         row_nr = int(search(r'\d+$', ret['updates']['updatedRange']).group())
         self.users_on_sheet[user_name.lower()] = sheet_title, row_nr
-        log.debug(f"{self.channel_name}:{sheet_title}:{row_nr} Added user {values[0]}:{values[1]}")
+        log.debug("%s:%s:%s Added user %s:%s", self.channel_name, sheet_title, row_nr, values[0], values[1])
 
     async def _replace(self, ws, row_nr, values):
         cells = await ws.range(f'A{row_nr}:{self.last_col}{row_nr}')
         for cell, value in zip(cells, values):
             cell.value = value
         await ws.update_cells(cells)
-        log.debug(f"{self.channel_name}:{ws.title}:{row_nr} Updated user {values[0]}:{values[1]}")
+        log.debug("%s:%s:%s Updated user %s:%s", self.channel_name, ws.title, row_nr, values[0], values[1])
 
     async def remove(self):
-        log.debug(f"{self.channel_name}: Deleting sheet")
+        log.debug("%s: Deleting sheet", self.channel_name)
         agc = await agcm.authorize()
         await agc.del_spreadsheet(self.sheet.id)
         title = self.channel_name
@@ -294,37 +401,97 @@ class BattleSheet:
 
     async def refresh_users(self):
         d = {}
-        ranges = ["'Subs'!A2:A", "'Not subs'!A2:A"]
-        resp = await self.batch_get(ranges, majorDimension='COLUMNS')
+        signup_rows = {}
+        # whole rows rather than just the names, in the same call, so signup_rows is complete too
+        ranges = [f"'{title}'!A2:Z" for title in self.signup_titles]
+        resp = await self.batch_get(ranges)
         for val_range in resp['valueRanges']:
             sheet_name = val_range['range'].split('!')[0].strip("'")
             if 'values' not in val_range:
                 continue
-            twitch_names = val_range['values'][0]
-            twitch_name_to_row_nr = {
-                name.lower(): (sheet_name, n)
-                for n, name in enumerate(twitch_names, 2)
-            }
-            d.update(twitch_name_to_row_nr)
-        log.debug(f"{self.channel_name}: Refreshed user dict from {len(self.users_on_sheet)} to {len(d)} users")
+            sub = sheet_name == 'Subs'
+            for n, row in enumerate(val_range['values'], 2):
+                if row and row[0]:
+                    name = row[0].lower()
+                    d[name] = sheet_name, n
+                    signup_rows[name] = sub, row
+        log.debug("%s: Refreshed user dict from %s to %s users", self.channel_name, len(self.users_on_sheet), len(d))
         self.users_on_sheet = d
+        self.signup_rows = signup_rows
+        self.stale = False
 
     async def refresh_headers(self):
-        log.debug(f"{self.channel_name}: Refreshing headers")
+        log.debug("%s: Refreshing headers", self.channel_name)
         worksheets = await self.sheet.worksheets()
         for ws in worksheets:
+            if ws.title not in self.signup_titles:
+                continue
             await ws.batch_update([self._header_data])
             ws.ws.format(self._header_data['range'], {"textFormat": {"bold": True}})
 
     async def clear(self):
-        log.debug(f"{self.channel_name}: Clearing sheet")
+        log.debug("%s: Clearing sheet", self.channel_name)
         call = self.sheet.agcm._call
         method = self.sheet.ss.client.request
-        batch_clear_url = f"https://sheets.googleapis.com/v4/spreadsheets/{self.sheet_key}/values:batchClear"
+        batch_clear_url = gspread.urls.SPREADSHEET_URL % self.sheet_key + "/values:batchClear"
         body = {"ranges": ["'Subs'", "'Not subs'"]}
         await call(method, 'post', batch_clear_url, json=body)
         await self.refresh_headers()
         self.users_on_sheet = {}
+        self.signup_rows = {}
+
+    async def signups(self):
+        """The header and rows of the signup worksheets, as (sub, header, rows) for each"""
+        ranges = [f"'{title}'!A1:Z" for title in self.signup_titles]
+        resp = await self.batch_get(ranges)
+        signups = []
+        for title, val_range in zip(self.signup_titles, resp['valueRanges']):
+            header, *rows = val_range.get('values', [[]])
+            signups.append((title == 'Subs', header, rows))
+        return signups
+
+    async def players(self):
+        """Everyone on the sheet with a rating, as lists of (rating, [twitch name, chess name]) for subs and
+        for non-subs"""
+        teams = []
+        for _, header, rows in await self.signups():
+            team = []
+            columns = rating_columns(header)
+            for row in rows:
+                rating, col = find_rating(row, columns)
+                if rating is not None:
+                    # the name that goes with the rating is the column before it
+                    team.append((rating, [row[0], row[col - 1]]))
+            teams.append(team)
+        return teams
+
+    async def write_pairings(self, pairing):
+        """Write a pairing to its own worksheet, replacing the last one"""
+        def cells(entry):
+            if entry is None:
+                return ['', '', '']
+            rating, row = entry
+            return [row[0], row[1], rating]
+
+        rows = [['Sub', 'Chess name', 'Rating', 'Not sub', 'Chess name', 'Rating', 'Gap']]
+        for sub, non_sub in pairing.pairs:
+            rows.append([*cells(sub), *cells(non_sub), abs(sub[0] - non_sub[0])])
+        leftovers = list(zip_longest(pairing.unpaired_subs, pairing.unpaired_non_subs))
+        if leftovers:
+            rows.append([])
+            rows.append(['Unpaired sub', 'Chess name', 'Rating', 'Unpaired non-sub', 'Chess name', 'Rating'])
+            rows.extend([*cells(sub), *cells(non_sub)] for sub, non_sub in leftovers)
+
+        try:
+            old = await self.sheet.worksheet(self.pairings_title)
+        except gspread.exceptions.WorksheetNotFound:
+            pass
+        else:
+            await self.sheet.del_worksheet(old)
+        ws = await self.sheet.add_worksheet(self.pairings_title, len(rows), len(rows[0]))
+        await ws.batch_update([{'range': f"A1:G{len(rows)}", 'values': rows}])
+        log.debug("%s: Wrote %s pairs", self.channel_name, len(pairing.pairs))
+        return ws
 
 
 async def all_sheet_names():
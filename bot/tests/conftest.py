@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the bot's modules import each other by plain name, as they do when run from bot/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import pytest
+
+from capture import ChatRecorder, read_capture
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    recorder = ChatRecorder(str(tmp_path / 'chat.jsonl.gz'), '?', ['apply', 'set', 'history', 'help'])
+    yield recorder
+    recorder.close()
+
+
+def test_chat_is_replaced(recorder):
+    assert recorder._scrub("hello there") == 'x' * len("hello there")
+
+
+def test_unknown_commands_keep_only_the_prefix(recorder):
+    assert recorder._scrub("?? some chat") == '?' + 'x' * len("? some chat")
+    assert recorder._scrub("?RealName says hi") == '?' + 'x' * len("RealName says hi")
+
+
+@pytest.mark.parametrize('content', [
+    "?apply RealName",
+    "?Apply RealName",
+    "?APPLY RealName OtherName",
+    "?history RealName 30",
+    "?set site RealName",
+])
+def test_every_argument_is_anonymized(recorder, content):
+    scrubbed = recorder._scrub(content)
+    command, *args = content.split(' ')
+    assert scrubbed.split(' ') == [command, *(recorder.anonymize(arg) for arg in args)]
+    assert 'realname' not in scrubbed.lower()
+    assert 'othername' not in scrubbed.lower()
+
+
+def test_same_name_same_alias(recorder):
+    assert recorder._scrub("?apply RealName") == recorder._scrub("?apply realname")
+    assert recorder._scrub("?apply RealName") != recorder._scrub("?apply OtherName")
+
+
+def test_spacing_survives(recorder):
+    assert recorder._scrub("?help") == "?help"
+    assert recorder._scrub("?apply  RealName ") == f"?apply  {recorder.anonymize('RealName')} "
+
+
+def test_recorded_messages_read_back(tmp_path):
+    path = str(tmp_path / 'chat.jsonl.gz')
+    recorder = ChatRecorder(path, '?', ['apply'])
+    author = SimpleNamespace(name='Viewer', is_subscriber=True, badges={}, is_mod=False)
+    recorder.record(SimpleNamespace(author=author, channel=SimpleNamespace(name='chan'), content="?apply RealName"))
+    recorder.close()
+
+    header, entries = read_capture(path)
+    assert header['prefix'] == '?'
+    [entry] = entries
+    assert entry['c'] == 'chan'
+    assert entry['u'] == recorder.anonymize('viewer')
+    assert entry['m'] == f"?apply {recorder.anonymize('RealName')}"
+    assert entry['s'] == 1 and 'o' not in entry
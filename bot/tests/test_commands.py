@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip('twitchio')
+os.environ.setdefault('BOT_NICK', 'subbatbot')  # read by globals on import, like in the benchmarks
+from exts.commands import Commands
+from scheduler import QueueFull
+
+
+class FakeBot:
+    def __init__(self):
+        self.whispers = []
+
+    def get_sheet(self, channel_name):
+        return SimpleNamespace()
+
+    async def _whisper(self, user, msg, ctx):
+        self.whispers.append((user, msg))
+
+
+class FakeApplies:
+    """Takes applies up to a queue depth, then turns them away"""
+    def __init__(self, max_queued):
+        self.max_queued = max_queued
+        self.queued = 0
+
+    def submit(self, apply):
+        if self.queued >= self.max_queued:
+            raise QueueFull(f"{self.queued} applies already waiting")
+        self.queued += 1
+        return self.queued
+
+
+def make_ctx(user, sent):
+    async def send(msg):
+        sent.append(msg)
+    return SimpleNamespace(channel=SimpleNamespace(name='chan'), author=SimpleNamespace(name=user), send=send)
+
+
+def test_turned_away_applies_are_always_answered():
+    bot = FakeBot()
+    commands = Commands(bot)
+    commands.applies = FakeApplies(Commands.notify_position + 1)
+    sent = []
+
+    async def main():
+        for i in range(Commands.notify_position + 4):
+            await Commands.apply._callback(commands, make_ctx(f"user{i}", sent), f"chess{i}")
+
+    asyncio.run(main())
+    # the depth notice went out once, and didn't hold back the replies to those turned away after it
+    assert len(sent) == 1
+    assert [user for user, _ in bot.whispers] == [f"user{i}" for i in range(Commands.notify_position + 1,
+                                                                            Commands.notify_position + 4)]
@@ -0,0 +1,71 @@
+from itertools import permutations
+import random
+
+import pytest
+
+from pairing import match_sorted, pair_players
+
+
+def brute_force_gap(subs, non_subs):
+    small, large = (subs, non_subs) if len(subs) <= len(non_subs) else (non_subs, subs)
+    return min(sum(abs(a[0] - b[0]) for a, b in zip(small, chosen))
+               for chosen in permutations(large, len(small)))
+
+
+def players(rng, n, prefix):
+    return [(rng.randint(400, 2800), f"{prefix}{i}") for i in range(n)]
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_smallest_total_gap(seed):
+    rng = random.Random(seed)
+    subs = players(rng, rng.randint(0, 6), 'sub')
+    non_subs = players(rng, rng.randint(0, 6), 'viewer')
+    pairing = pair_players(subs, non_subs)
+
+    assert len(pairing.pairs) == min(len(subs), len(non_subs))
+    assert pairing.total_gap == brute_force_gap(subs, non_subs)
+    assert sorted(pairing.unpaired_subs + [s for s, _ in pairing.pairs]) == sorted(subs)
+    assert sorted(pairing.unpaired_non_subs + [n for _, n in pairing.pairs]) == sorted(non_subs)
+
+
+def test_same_size_pairs_by_rank():
+    subs = [(1000, 'a'), (2000, 'b'), (1500, 'c')]
+    non_subs = [(2100, 'x'), (900, 'y'), (1400, 'z')]
+    pairing = pair_players(subs, non_subs)
+    assert pairing.pairs == [((1000, 'a'), (900, 'y')), ((1500, 'c'), (1400, 'z')), ((2000, 'b'), (2100, 'x'))]
+
+
+def test_surplus_sits_out():
+    subs = [(1500, 'a'), (1600, 'b')]
+    non_subs = [(800, 'x'), (1490, 'y'), (1620, 'z'), (2500, 'w')]
+    pairing = pair_players(subs, non_subs)
+    assert pairing.pairs == [((1500, 'a'), (1490, 'y')), ((1600, 'b'), (1620, 'z'))]
+    assert pairing.unpaired_non_subs == [(800, 'x'), (2500, 'w')]
+    assert pairing.unpaired_subs == []
+
+
+def test_max_gap_leaves_distant_players_unpaired():
+    subs = [(1500, 'a'), (2600, 'b')]
+    non_subs = [(1450, 'x'), (1000, 'y')]
+    pairing = pair_players(subs, non_subs, max_gap=200)
+    assert pairing.pairs == [((1500, 'a'), (1450, 'x'))]
+    assert pairing.unpaired_subs == [(2600, 'b')]
+    assert pairing.unpaired_non_subs == [(1000, 'y')]
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_narrow_window(seed):
+    rng = random.Random(seed)
+    small = sorted(rng.randint(400, 2800) for _ in range(rng.randint(1, 5)))
+    large = sorted(rng.randint(400, 2800) for _ in range(len(small) + rng.randint(1, 4)))
+    window = rng.randint(1, 3)
+    matches = match_sorted(small, large, window)
+
+    assert [i for i, _ in matches] == list(range(len(small)))
+    assert all(j1 < j2 for (_, j1), (_, j2) in zip(matches, matches[1:]))
+    gap = sum(abs(small[i] - large[j]) for i, j in matches)
+    best = brute_force_gap([(r, None) for r in small], [(r, None) for r in large])
+    assert gap >= best
+    if len(large) - len(small) <= window:
+        assert gap == best
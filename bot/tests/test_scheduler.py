@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+import asyncio
+
+import pytest
+
+from scheduler import Apply, ApplyScheduler, QueueFull
+
+
+def make_apply(channel, user, chess_name, sub=False, lichess_name=None):
+    author = SimpleNamespace(name=user, is_subscriber=sub, badges={})
+    ctx = SimpleNamespace(channel=SimpleNamespace(name=channel), author=author)
+    return Apply(ctx, chess_name, lichess_name)
+
+
+def test_channels_take_turns():
+    handled = []
+
+    async def handler(apply):
+        handled.append((apply.channel_name, apply.chess_name))
+
+    async def main():
+        scheduler = ApplyScheduler(handler, workers=1)
+        for i in range(4):
+            scheduler.submit(make_apply('big', f"user{i}", f"big{i}"))
+        scheduler.submit(make_apply('small', 'user0', 'small0'))
+        await scheduler.join()
+
+    asyncio.run(main())
+    assert handled == [('big', 'big0'), ('small', 'small0'), ('big', 'big1'), ('big', 'big2'), ('big', 'big3')]
+
+
+def test_waiting_apply_is_updated_in_place():
+    handled = []
+
+    async def handler(apply):
+        handled.append(apply.chess_name)
+
+    async def main():
+        scheduler = ApplyScheduler(handler, workers=1)
+        assert scheduler.submit(make_apply('chan', 'a', 'first')) == 1
+        assert scheduler.submit(make_apply('chan', 'b', 'other')) == 2
+        assert scheduler.submit(make_apply('chan', 'a', 'second')) == 1
+        assert scheduler.queued('chan') == 2
+        await scheduler.join()
+
+    asyncio.run(main())
+    assert handled == ['second', 'other']
+
+
+def test_repeat_turned_away_only_after_a_write():
+    async def main():
+        scheduler = ApplyScheduler(lambda apply: asyncio.sleep(0), workers=1)
+        apply = make_apply('chan', 'a', 'name')
+        scheduler.submit(apply)
+        await scheduler.join()
+        # handled, but it never made it onto the sheet, so trying again goes through
+        assert scheduler.submit(make_apply('chan', 'a', 'name')) == 1
+        await scheduler.join()
+
+        scheduler.done(apply)
+        assert scheduler.submit(make_apply('chan', 'a', 'Name')) is None
+        assert scheduler.submit(make_apply('chan', 'a', 'name', sub=True)) == 1
+        assert scheduler.submit(make_apply('chan', 'a', 'name', lichess_name='other')) == 1
+        await scheduler.join()
+
+        assert scheduler.submit(make_apply('chan', 'a', 'name'), retry=True) == 1
+        await scheduler.join()
+
+        scheduler.forget('chan')
+        assert scheduler.submit(make_apply('chan', 'a', 'name')) == 1
+        await scheduler.join()
+
+    asyncio.run(main())
+
+
+def test_repeat_goes_through_after_debounce():
+    async def main():
+        scheduler = ApplyScheduler(lambda apply: asyncio.sleep(0), workers=1, debounce=10)
+        apply = make_apply('chan', 'a', 'name')
+        scheduler.done(apply)
+        later = make_apply('chan', 'a', 'name')
+        later.submitted += 11
+        assert scheduler.submit(later) == 1
+        await scheduler.join()
+
+    asyncio.run(main())
+
+
+def test_queue_full():
+    async def main():
+        scheduler = ApplyScheduler(lambda apply: asyncio.sleep(0), workers=1, max_queued=2)
+        scheduler.submit(make_apply('chan', 'a', 'a'))
+        scheduler.submit(make_apply('chan', 'b', 'b'))
+        with pytest.raises(QueueFull):
+            scheduler.submit(make_apply('chan', 'c', 'c'))
+        # other channels have their own limit
+        assert scheduler.submit(make_apply('other', 'c', 'c')) == 1
+        await scheduler.join()
+
+    asyncio.run(main())
+
+
+def test_failing_handler_does_not_stop_the_queue():
+    handled = []
+
+    async def handler(apply):
+        handled.append(apply.chess_name)
+        if apply.chess_name == 'bad':
+            raise ValueError('boom')
+
+    async def main():
+        scheduler = ApplyScheduler(handler, workers=1)
+        scheduler.submit(make_apply('chan', 'a', 'bad'))
+        scheduler.submit(make_apply('chan', 'b', 'good'))
+        await scheduler.join()
+
+    asyncio.run(main())
+    assert handled == ['bad', 'good']
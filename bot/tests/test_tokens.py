@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip('gspread_asyncio')
+os.environ.setdefault('BOT_NICK', 'subbatbot')  # read by globals on import, like in the benchmarks
+import sheet
+import tokens
+
+
+class FakeAGCM:
+    def __init__(self, lifetime):
+        self.lifetime = lifetime
+        self.auth_time = 0
+        self.refreshes = 0
+
+    def seconds_left(self):
+        return self.lifetime
+
+    async def refresh(self):
+        self.refreshes += 1
+
+
+def keep_fresh_sleeps(monkeypatch, lifetime, rounds=3):
+    """Run the Google refresh loop until it has slept `rounds` times, and return the sleeps and refreshes"""
+    agcm = FakeAGCM(lifetime)
+    monkeypatch.setattr(sheet, 'agcm', agcm)
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay):
+        sleeps.append(delay)
+        if len(sleeps) >= rounds:
+            raise asyncio.CancelledError()
+        await real_sleep(0)
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+
+    manager = tokens.TokenManager(db=None, margin=300, retry_delay=60)
+
+    async def main():
+        with pytest.raises(asyncio.CancelledError):
+            await manager._keep_fresh('Google', manager._google_left, manager._refresh_google)
+
+    asyncio.run(main())
+    return sleeps, agcm.refreshes
+
+
+def test_sleeps_until_the_margin(monkeypatch):
+    sleeps, refreshes = keep_fresh_sleeps(monkeypatch, lifetime=3600)
+    assert sleeps == [3300] * 3
+    assert refreshes == 0
+
+
+def test_short_lifetime_does_not_refresh_back_to_back(monkeypatch):
+    sleeps, refreshes = keep_fresh_sleeps(monkeypatch, lifetime=45)
+    assert sleeps == [60] * 3
+    assert refreshes == 3
+
+
+def test_expiry_comes_from_the_token(monkeypatch):
+    gc = SimpleNamespace(auth=SimpleNamespace(token_expiry=datetime.utcnow() + timedelta(seconds=3600)),
+                         session=None, login=lambda: None)
+    monkeypatch.setattr(sheet.gspread, 'authorize', lambda creds: gc)
+
+    async def main():
+        agcm = sheet.CustomAGCM(lambda: None)
+        agcm._loop = asyncio.get_event_loop()
+        assert agcm.seconds_left() == 0
+        await agcm.refresh()
+        return agcm.seconds_left()
+
+    assert 3590 < asyncio.run(main()) <= 3600
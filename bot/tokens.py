@@ -0,0 +1,72 @@
+"""
+Background renewal of the Google and Twitch credentials.
+
+Both are refreshed some minutes before they run out, so the apply or follow that happens to come next
+never has to wait for an authorization round trip.
+"""
+
+from functools import partial
+import asyncio
+import logging
+
+import twitch_api
+import sheet
+
+
+log = logging.getLogger(__name__)
+
+
+class TokenManager:
+    def __init__(self, db, margin=300, retry_delay=60):
+        self.db = db
+        self.margin = margin  # seconds before expiry to refresh
+        self.retry_delay = retry_delay
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [
+            asyncio.ensure_future(self._keep_fresh('Google', self._google_left, self._refresh_google)),
+            asyncio.ensure_future(self._keep_fresh('Twitch', self._twitch_left, self._refresh_twitch)),
+        ]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+    async def _keep_fresh(self, name, seconds_left, refresh):
+        while True:
+            try:
+                left = await seconds_left()
+                if left <= self.margin:
+                    await refresh()
+                    log.debug("Refreshed %s credentials ahead of expiry", name)
+                    left = await seconds_left()
+                # credentials that don't outlast the margin would otherwise be refreshed back to back
+                await asyncio.sleep(max(left - self.margin, self.retry_delay))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception("Failed to refresh %s credentials, retrying in %ss: %s", name, self.retry_delay, e)
+                await asyncio.sleep(self.retry_delay)
+
+    async def _google_left(self):
+        return sheet.agcm.seconds_left()
+
+    async def _refresh_google(self):
+        if sheet.agcm.auth_time is None:
+            # first authorization also sets the manager up with the loop
+            await sheet.agcm.authorize()
+        else:
+            await sheet.agcm.refresh()
+
+    async def _twitch_left(self):
+        # read from the database here on the loop, the executor only does http
+        twitch_api.get_bearer_token(self.db)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, twitch_api.seconds_left)
+
+    async def _refresh_twitch(self):
+        loop = asyncio.get_event_loop()
+        refresh = partial(twitch_api.refresh_token, stale=twitch_api.TOKEN['access_token'])
+        token = await loop.run_in_executor(None, refresh)
+        self.db.update_token(token)
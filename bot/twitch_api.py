@@ -7,7 +7,9 @@ oAuth process:
 """
 
 import os
+import time
 import logging
+import threading
 from functools import lru_cache
 
 import requests
@@ -19,8 +21,12 @@ from globals import DEV_MODE, SBB_ID, SBBD_ID
 TWITCH_AUTH_URL = "https://id.twitch.tv/oauth2/authorize"
 TWITCH_TOKEN_URL = "https://id.twitch.tv/oauth2/token"
 TWITCH_REFRESH_URL = "https://id.twitch.tv/oauth2/token"
+TWITCH_VALIDATE_URL = "https://id.twitch.tv/oauth2/validate"
+TWITCH_HELIX_URL = "https://api.twitch.tv/helix"
 REDIRECT_URI = "https://localhost"
 TOKEN = None
+TOKEN_EXPIRY = None  # time.time() when TOKEN runs out, once known
+_refresh_lock = threading.Lock()
 log = logging.getLogger(__name__)
 
 
@@ -52,26 +58,45 @@ def get_new_bearer(code, db=None):
     return TOKEN
 
 
-def refresh_token(db=None):
-    params = {
-        'client_id': os.environ['CLIENT_ID'],
-        'client_secret': os.environ['CLIENT_SECRET'],
-        'grant_type': 'refresh_token',
-        'refresh_token': TOKEN['refresh_token'],
-    }
-    new_token = requests.post(TWITCH_REFRESH_URL, params=params).json()
-    log.debug(f"Refreshed token from {TOKEN['access_token'][:5]} to {new_token['access_token'][:5]}")
-    TOKEN.update(new_token)
+def refresh_token(db=None, stale=None):
+    """Refresh TOKEN. If the stale access token is given and TOKEN has already moved on from it,
+    someone else got to the refresh first and it isn't repeated."""
+    global TOKEN_EXPIRY
+    with _refresh_lock:
+        if stale is not None and TOKEN['access_token'] != stale:
+            return TOKEN
+        params = {
+            'client_id': os.environ['CLIENT_ID'],
+            'client_secret': os.environ['CLIENT_SECRET'],
+            'grant_type': 'refresh_token',
+            'refresh_token': TOKEN['refresh_token'],
+        }
+        new_token = requests.post(TWITCH_REFRESH_URL, params=params, timeout=10).json()
+        log.debug("Refreshed token from %s to %s", TOKEN['access_token'][:5], new_token['access_token'][:5])
+        TOKEN.update(new_token)
+        TOKEN_EXPIRY = time.time() + new_token['expires_in']
     if db:
         db.update_token(TOKEN)
     return TOKEN
 
 
+def seconds_left(db=None):
+    """How long TOKEN stays valid, asking twitch the first time"""
+    global TOKEN_EXPIRY
+    if TOKEN_EXPIRY is None:
+        token = get_bearer_token(db)
+        headers = {'Authorization': f"OAuth {token['access_token']}"}
+        resp = requests.get(TWITCH_VALIDATE_URL, headers=headers, timeout=10)
+        # an invalid token has no time left
+        TOKEN_EXPIRY = time.time() + (resp.json()['expires_in'] if resp.ok else 0)
+    return TOKEN_EXPIRY - time.time()
+
+
 def get_bearer_token(db):
     global TOKEN
     if TOKEN is None:
         TOKEN = db.get_token()
-    log.debug(f"Fetched token: {TOKEN['access_token'][:5]}")
+    log.debug("Fetched token: %s", TOKEN['access_token'][:5])
     return TOKEN
 
 
@@ -84,14 +109,14 @@ def add_follow(user_id=None, username=None, db=None):
         from_id = str(SBBD_ID)
     else:
         from_id = str(SBB_ID)
-    log.debug(f"Requesting follow to name={username}, id={user_id}")
-    url = 'https://api.twitch.tv/helix/users/follows'
+    log.debug("Requesting follow to name=%s, id=%s", username, user_id)
+    url = f'{TWITCH_HELIX_URL}/users/follows'
     make_private_req(url, method='post', db=db, login=username, from_id=from_id, to_id=str(user_id))
 
 
 def get_user_id(username, db=None):
-    log.debug(f"Looking up ID for user {username}")
-    url = f"https://api.twitch.tv/helix/users"
+    log.debug("Looking up ID for user %s", username)
+    url = f"{TWITCH_HELIX_URL}/users"
     d = make_private_req(url, db=db, json=True, login=username)
     return int(d['data'][0]['id'])
 
@@ -106,10 +131,10 @@ def make_private_req(url, method='get', attempts=0, db=None, json=False, **param
     resp = function(url, headers=headers, params=params)
     if resp.status_code == 401:
         if attempts == 1:
-            log.error(f"Unauthorized even after refresh! {url}, {params}, token {token['access_token'][:5]}")
+            log.error("Unauthorized even after refresh! %s, %s, token %s", url, params, token['access_token'][:5])
             return
-        log.info(f"Token {token['access_token'][:5]} looks invalid")
-        refresh_token(db)
+        log.info("Token %s looks invalid", token['access_token'][:5])
+        refresh_token(db, stale=token['access_token'])
         return make_private_req(url, method=method, attempts=1, db=db, json=json, **params)
     resp.raise_for_status()
     if json:
@@ -122,7 +147,7 @@ def get_moderated_channels(user):
     botname = 'sbbdev' if DEV_MODE else 'subbatbot'
     r = requests.get(url, timeout=4, headers={"user-agent": f"https://www.twitch.tv/{botname}"})
     if r.status_code != 200:
-        return log.error(f"Mod lookup failed with status {r.status_code} for user {user}")
+        return log.error("Mod lookup failed with status %s for user %s", r.status_code, user)
     dct = r.json()
     return {ch['name'] for ch in dct['channels']}
 
@@ -0,0 +1,113 @@
+"""
+Event loop stall detection.
+
+A heartbeat coroutine ticks on the event loop, while a watcher thread checks how long ago the last tick was.
+If the loop is stuck for longer than the threshold, the watcher samples the stack of the loop thread to find
+out what is blocking it, and keeps a tally of the culprits.
+"""
+
+from collections import Counter
+import threading
+import asyncio
+import logging
+import time
+import sys
+import os
+
+
+log = logging.getLogger(__name__)
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopWatchdog:
+    def __init__(self, threshold=0.1, interval=0.02, report_interval=600):
+        # all in seconds
+        self.threshold = threshold
+        self.interval = interval
+        self.report_interval = report_interval
+
+        # culprit -> number of stalls, and culprit -> total seconds blocked
+        self.stalls = Counter()
+        self.blocked_time = Counter()
+
+        self._last_tick = None
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+        self._tasks = []
+
+    def start(self):
+        """Start watching the running loop. Must be called from the loop's own thread."""
+        loop = asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._tasks = [
+            loop.create_task(self._heartbeat()),
+            loop.create_task(self._report_periodically()),
+        ]
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+        log.info("Watching event loop for stalls over %.0f ms", self.threshold * 1000)
+
+    def stop(self):
+        self._stopped.set()
+        for task in self._tasks:
+            task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            self._last_tick = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    async def _report_periodically(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.report()
+
+    def _watch(self):
+        stalled_tick = None
+        samples = Counter()
+        while not self._stopped.wait(self.interval / 2):
+            tick = self._last_tick
+            # the loop got going again, so the stall is over and its length known
+            if stalled_tick is not None and tick != stalled_tick:
+                self._record(samples, tick - stalled_tick - self.interval)
+                stalled_tick = None
+                samples = Counter()
+            if time.monotonic() - tick - self.interval > self.threshold:
+                stalled_tick = tick
+                samples[self._sample()] += 1
+
+    def _sample(self):
+        """Describe what the loop thread is doing right now.
+
+        Blames the innermost frame that belongs to the bot, since that is the line making the blocking call,
+        and adds the innermost function overall to show what was actually blocking.
+        """
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return 'unknown'
+        innermost = frame.f_code.co_name
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(BOT_DIR) and filename != __file__:
+                where = os.path.relpath(filename, BOT_DIR)
+                return f"{where}:{frame.f_lineno} {frame.f_code.co_name} -> {innermost}"
+            frame = frame.f_back
+        return innermost
+
+    def _record(self, samples, duration):
+        culprit, _ = samples.most_common(1)[0]
+        self.stalls[culprit] += 1
+        self.blocked_time[culprit] += duration
+        log.warning("Event loop blocked for %.0f ms in %s", duration * 1000, culprit)
+
+    def top(self, n=10):
+        """Return the n worst culprits as (culprit, number of stalls, seconds blocked), worst first"""
+        return [(culprit, self.stalls[culprit], seconds) for culprit, seconds in self.blocked_time.most_common(n)]
+
+    def report(self, n=10):
+        ranking = self.top(n)
+        if not ranking:
+            return
+        lines = '\n'.join(f"  {seconds:8.3f}s {count:6}x  {culprit}" for culprit, count, seconds in ranking)
+        log.info("Event loop stalls by total blocked time:\n%s", lines)